@@ -1,27 +1,171 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_from_directory, g
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 import os
 import random
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, features
 import io
 import base64
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
 import google.generativeai as genai
-import whisper
-from googletrans import Translator
-import torch
+import whisper_worker
 import subprocess
 import ffmpeg
 import uuid
 import logging
 import urllib.parse
+import re
+import functools
+import tempfile
+import numpy as np
+import hmac
+import json
+import bisect
+import contextlib
+import hashlib
+import sqlite3
+from collections import OrderedDict, deque
+import threading
+import queue
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 
 # for LLM as a Judge 
 logging.basicConfig(level=logging.INFO)
 
+# Share of judge/reflexion steps written to the vibecheck.judge debug log
+# (one JSON record each); 0 keeps the hot path free of console I/O
+JUDGE_LOG_SAMPLE_RATE = float(os.getenv("JUDGE_LOG_SAMPLE_RATE", "0"))
+judge_logger = logging.getLogger("vibecheck.judge")
+if JUDGE_LOG_SAMPLE_RATE > 0:
+    judge_logger.setLevel(logging.DEBUG)
+
+def judge_log_sampled():
+    return JUDGE_LOG_SAMPLE_RATE > 0 and random.random() < JUDGE_LOG_SAMPLE_RATE
+
 def log_reflexion(step, content):
-    logging.info(f"\n\n================ {step} ================\n{content}\n")
+    if judge_log_sampled():
+        judge_logger.debug(json.dumps({"step": step, "content": content}, ensure_ascii=False))
+
+# Same for meme renders and reuses on the vibecheck.memes logger
+MEME_LOG_SAMPLE_RATE = float(os.getenv("MEME_LOG_SAMPLE_RATE", "0"))
+meme_logger = logging.getLogger("vibecheck.memes")
+if MEME_LOG_SAMPLE_RATE > 0:
+    meme_logger.setLevel(logging.DEBUG)
+
+def log_meme(event, **fields):
+    if MEME_LOG_SAMPLE_RATE > 0 and random.random() < MEME_LOG_SAMPLE_RATE:
+        meme_logger.debug(json.dumps({"event": event, **fields}, ensure_ascii=False))
+
+# ============= METRICS =============
+
+# Histogram bucket upper bounds in seconds, from an emotion pass to a slow Gemini/Whisper call
+LATENCY_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Counter:
+    """Prometheus-style counter with one value per label combination"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    """Prometheus-style histogram with fixed buckets per label combination"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS_S):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+stage_seconds = Histogram("vibecheck_stage_seconds", "Time spent in each pipeline stage", ("stage",))
+stage_errors = Counter("vibecheck_stage_errors_total", "Pipeline stage calls that raised", ("stage",))
+gemini_seconds = Histogram("vibecheck_gemini_request_seconds", "Gemini API call latency, cache hits excluded", ("call_site",))
+gemini_calls = Counter("vibecheck_gemini_calls_total", "Gemini calls by call site and outcome (ok, error, cache_hit)",
+                       ("call_site", "outcome"))
+http_seconds = Histogram("vibecheck_http_request_seconds", "Time to produce the response (streams: until headers)",
+                         ("endpoint", "method", "status"))
+gemini_retries = Counter("vibecheck_gemini_retries_total", "Gemini attempts retried after a transient failure", ("call_site",))
+gemini_hedges = Counter("vibecheck_gemini_hedges_total", "Hedged Gemini attempts started, and how many won", ("call_site", "result"))
+caption_candidates = Counter("vibecheck_caption_candidates_total", "Caption candidates by how the judging policy handled them", ("mode", "fate"))
+caption_bank_lookups = Counter("vibecheck_caption_bank_lookups_total", "Meme caption requests by caption bank outcome", ("outcome",))
+judge_scores = Histogram("vibecheck_judge_total_score", "Total judge score per judged candidate",
+                         buckets=tuple(range(1, 11)))
+METRICS = [stage_seconds, stage_errors, gemini_seconds, gemini_calls, gemini_retries, gemini_hedges,
+           caption_candidates, caption_bank_lookups, http_seconds, judge_scores]
+
+@contextlib.contextmanager
+def timed_stage(stage):
+    """Record the duration (and failure) of a pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+def instrumented(stage):
+    """Decorator form of timed_stage()"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed_stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
 
 app = Flask(__name__)
 
@@ -32,23 +176,34 @@ def set_ffmpeg_path():
 
 CORS(app)
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        http_seconds.observe(time.perf_counter() - started, endpoint=endpoint,
+                             method=request.method, status=response.status_code)
+    return response
+
 # Configuration
-UPLOAD_FOLDER = 'uploads'
 MEMES_FOLDER = 'memes_images'
 ALLOWED_EXTENSIONS = {'wav', 'mp3', 'm4a', 'ogg', 'webm'}
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 MEMES_OUTPUT_FOLDER = 'memes'
 os.makedirs(MEMES_OUTPUT_FOLDER, exist_ok=True)
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
 # Global models
 emotion_pipeline = None
+emotion_tokenizer = None
 gemini_model = None
 whisper_model = None
-translator = Translator()
+translator = None
 
 # Urdu to Roman character mapping
 char_map = {
@@ -62,7 +217,45 @@ char_map = {
 
 @app.route('/memes/<path:filename>')
 def serve_meme(filename):
-    return send_file(os.path.join(MEMES_OUTPUT_FOLDER, filename))
+    match = CONTENT_MEME_RE.match(filename)
+    if not match:
+        return send_from_directory(MEMES_OUTPUT_FOLDER, filename)
+
+    key, variant, ext = match.groups()
+    negotiated = False
+    if not variant and ext == "jpg":
+        token = request.args.get("t")
+        if token and not os.path.exists(os.path.join(MEMES_OUTPUT_FOLDER, filename)):
+            if not render_deferred_meme(filename, key, token):
+                return jsonify({'error': 'Invalid meme link'}), 404
+
+        # Pick a WebP and/or downsized variant from Accept and ?w=<width>;
+        # the master JPEG stays the fallback.
+        negotiated = True
+        width = request.args.get("w")
+        if width is not None:
+            if not (width.isascii() and width.isdigit() and int(width) > 0):
+                return jsonify({'error': 'w must be a positive integer width in pixels'}), 400
+            width = pick_variant_width(int(width))
+        variant_ext = "webp" if client_accepts_webp() else "jpg"
+        if (width or variant_ext != "jpg") and os.path.exists(os.path.join(MEMES_OUTPUT_FOLDER, filename)):
+            filename, variant = ensure_meme_variant(key, width, variant_ext)
+
+    touch_meme(filename)
+    if negotiated and filename != meme_filename(key):
+        # Variants are derived from the master, so keep it alive as well
+        touch_meme(meme_filename(key))
+
+    # Content-addressed files never change, so the hash is a strong ETag
+    # and clients may cache them forever.
+    etag = key + (f"-{variant}-{filename.rsplit('.', 1)[1]}" if variant else "")
+    response = send_from_directory(MEMES_OUTPUT_FOLDER, filename, etag=etag,
+                                   max_age=MEME_HTTP_MAX_AGE_S, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if negotiated:
+        response.vary.add("Accept")
+    return response
 
 def urdu_to_roman(text):
     return "".join([char_map.get(ch, ch) for ch in text])
@@ -70,57 +263,513 @@ def urdu_to_roman(text):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def setup_models():
-    """Initialize all ML models at startup"""
-    global emotion_pipeline, gemini_model, whisper_model
-    
-    print("🧠 Loading emotion detection model...")
-    model_name = "SamLowe/roberta-base-go_emotions"
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-    emotion_pipeline = pipeline("text-classification", model=model, tokenizer=tokenizer, return_all_scores=True)
-    print("✅ Emotion model ready!")
-    
-    print("🤖 Setting up Gemini API...")
-    api_key = os.getenv("GEMINI_API_KEY", "YOUR_API_KEY_HERE")
-    genai.configure(api_key=api_key)
-    model_names = ['gemini-2.5-flash', 'gemini-2.5-pro']
-    for name in model_names:
+# ============= EMOTION MODEL BACKENDS =============
+
+EMOTION_MODEL_NAME = "SamLowe/roberta-base-go_emotions"
+# torch (fp32), torch-int8 (dynamic quantization), onnx, onnx-int8
+EMOTION_BACKEND = os.getenv("EMOTION_BACKEND", "torch").lower()
+# Intra-op threads for torch / ONNX Runtime; 0 keeps the library default
+EMOTION_NUM_THREADS = int(os.getenv("EMOTION_NUM_THREADS", "0"))
+EMOTION_ONNX_PATH = os.getenv("EMOTION_ONNX_PATH", os.path.join("models", "roberta-go-emotions.onnx"))
+EMOTION_MAX_LENGTH = 512
+EMOTION_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+class InferenceModePipeline:
+    """transformers pipeline wrapper that runs every call under torch.inference_mode()"""
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.tokenizer = pipe.tokenizer
+
+    def __call__(self, inputs, **kwargs):
+        import torch
+        with torch.inference_mode():
+            return self.pipe(inputs, **kwargs)
+
+class OnnxEmotionPipeline:
+    """
+    ONNX Runtime session with the same call/return shape as the
+    text-classification pipeline with return_all_scores=True.
+    """
+
+    def __init__(self, onnx_path, tokenizer, config, num_threads=0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("EMOTION_BACKEND=onnx needs onnxruntime (pip install onnxruntime)") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = tokenizer
+        self.labels = [config.id2label[i] for i in range(config.num_labels)]
+        self.multi_label = config.problem_type == "multi_label_classification"
+
+    def __call__(self, inputs, batch_size=None, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        step = batch_size or len(texts) or 1
+        results = []
+        for start in range(0, len(texts), step):
+            encoded = self.tokenizer(texts[start:start + step], padding=True, truncation=True,
+                                     max_length=EMOTION_MAX_LENGTH, return_tensors="np")
+            feed = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+            logits = self.session.run(None, feed)[0]
+            if self.multi_label:
+                scores = 1.0 / (1.0 + np.exp(-logits))
+            else:
+                exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+                scores = exp / exp.sum(axis=1, keepdims=True)
+            for row in scores:
+                results.append([{"label": label, "score": float(score)} for label, score in zip(self.labels, row)])
+        return results
+
+def export_emotion_onnx(model, tokenizer, onnx_path, quantize=False):
+    """Export the classifier to ONNX (and optionally int8-quantize it) once"""
+    import torch
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, input_ids, attention_mask):
+            return self.inner(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    fp32_path = onnx_path.replace(".int8.onnx", ".onnx") if quantize else onnx_path
+    if not os.path.exists(fp32_path):
+        print(f"📦 Exporting emotion model to {fp32_path}...")
+        sample = tokenizer(["exporting the emotion model"], return_tensors="pt")
+        with torch.no_grad():
+            torch.onnx.export(
+                LogitsOnly(model.eval()),
+                (sample["input_ids"], sample["attention_mask"]),
+                fp32_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["logits"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "logits": {0: "batch"},
+                },
+                opset_version=14,
+            )
+
+    if quantize and not os.path.exists(onnx_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print(f"📦 Quantizing emotion model to {onnx_path}...")
+        quantize_dynamic(fp32_path, onnx_path, weight_type=QuantType.QInt8)
+    return onnx_path
+
+def load_emotion_pipeline(backend=None):
+    """
+    Build the emotion classifier for the selected backend. Every backend is
+    called like the transformers pipeline and returns the same score lists.
+    """
+    backend = (backend or EMOTION_BACKEND).lower()
+    if backend not in EMOTION_BACKENDS:
+        raise ValueError(f"Unknown EMOTION_BACKEND '{backend}', expected one of {EMOTION_BACKENDS}")
+
+    # Imported here so the server process starts without paying for torch
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+
+    if EMOTION_NUM_THREADS > 0:
+        torch.set_num_threads(EMOTION_NUM_THREADS)
+
+    tokenizer = AutoTokenizer.from_pretrained(EMOTION_MODEL_NAME)
+    model = AutoModelForSequenceClassification.from_pretrained(EMOTION_MODEL_NAME).eval()
+
+    if backend.startswith("onnx"):
+        quantize = backend == "onnx-int8"
+        onnx_path = EMOTION_ONNX_PATH.replace(".onnx", ".int8.onnx") if quantize else EMOTION_ONNX_PATH
+        export_emotion_onnx(model, tokenizer, onnx_path, quantize=quantize)
+        return OnnxEmotionPipeline(onnx_path, tokenizer, model.config, EMOTION_NUM_THREADS)
+
+    if backend == "torch-int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    # Decoded windows can re-encode slightly longer, so always truncate like the ONNX path
+    return InferenceModePipeline(
+        pipeline("text-classification", model=model, tokenizer=tokenizer, return_all_scores=True,
+                 truncation=True, max_length=EMOTION_MAX_LENGTH)
+    )
+
+# ============= MODEL LOADING =============
+
+GEMINI_MODEL_NAMES = ['gemini-2.5-flash', 'gemini-2.5-pro']
+# Load Whisper on the first voice request instead of at startup
+WHISPER_LAZY_LOAD = os.getenv("WHISPER_LAZY_LOAD", "0") == "1"
+# How long a request waits for a model that is still loading
+MODEL_WAIT_TIMEOUT_S = float(os.getenv("MODEL_WAIT_TIMEOUT_S", "60"))
+
+model_loader = ThreadPoolExecutor(max_workers=3, thread_name_prefix="model-loader")
+
+class ModelNotReadyError(RuntimeError):
+    """A model needed for the request is still loading or failed to load"""
+
+class ModelSlot:
+    """
+    Load state of one model: idle -> loading -> ready | failed.
+    Loading runs on model_loader, so several models load at once and
+    requests only wait for the model they actually need.
+    """
+
+    def __init__(self, name, loader, required=True):
+        self.name = name
+        self.loader = loader
+        # Optional models don't hold back /api/ready
+        self.required = required
+        self.state = "idle"
+        self.error = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self):
+        """Begin loading unless already loading or loaded (a failed load is retried)"""
+        with self._lock:
+            if self.state in ("loading", "ready"):
+                return
+            self.state = "loading"
+            self.error = None
+            self._done.clear()
+        model_loader.submit(self._load)
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            self.loader()
+            self.state = "ready"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            print(f"❌ Failed to load {self.name} model: {e}")
+        finally:
+            self.load_seconds = round(time.perf_counter() - started, 2)
+            self._done.set()
+
+    def ensure(self, timeout=None):
+        """Load on first use and wait for it; raises ModelNotReadyError"""
+        if self.state == "ready":
+            return
+        self.start()
+        timeout = MODEL_WAIT_TIMEOUT_S if timeout is None else timeout
+        if not self._done.wait(timeout):
+            raise ModelNotReadyError(f"The {self.name} model is still loading, please try again shortly")
+        if self.state != "ready":
+            raise ModelNotReadyError(f"The {self.name} model failed to load: {self.error}")
+
+    def status(self):
+        return {
+            'state': self.state,
+            'required': self.required,
+            'load_seconds': self.load_seconds,
+            'error': self.error
+        }
+
+def load_emotion_model():
+    global emotion_pipeline, emotion_tokenizer
+    print(f"🧠 Loading emotion detection model ({EMOTION_BACKEND})...")
+    emotion_pipeline = load_emotion_pipeline(EMOTION_BACKEND)
+    emotion_tokenizer = emotion_pipeline.tokenizer
+    emotion_batcher.start()
+    print(f"✅ Emotion model ready! (batching up to {EMOTION_BATCH_MAX_SIZE} texts / {EMOTION_BATCH_MAX_WAIT_MS:g} ms)")
+
+def probe_gemini():
+    """
+    Pick the first Gemini model that answers. Runs off the startup path;
+    until it finishes, calls go to the first model in GEMINI_MODEL_NAMES.
+    """
+    global gemini_model
+    for name in GEMINI_MODEL_NAMES:
         try:
             gemini_candidate = genai.GenerativeModel(name)
             gemini_candidate.generate_content("Hello")
             gemini_model = gemini_candidate
             print(f"✅ Connected to Gemini model: {name}")
-            break
+            return
         except Exception as e:
             print(f"⚠️ Failed to connect to {name}: {e}")
+    raise RuntimeError(f"No Gemini model answered ({', '.join(GEMINI_MODEL_NAMES)})")
+
+def load_whisper_model():
+    global whisper_model
+    if WHISPER_WORKERS > 0:
+        print(f"🎤 Starting {WHISPER_WORKERS} Whisper worker processes ({WHISPER_MODEL_SIZE})...")
+        start_whisper_pool()
+        print("✅ Whisper workers ready!")
+    else:
+        print(f"🎤 Loading Whisper model ({WHISPER_MODEL_SIZE})...")
+        whisper_model = whisper_worker.load_model(WHISPER_MODEL_SIZE)
+        print("✅ Whisper model ready!")
+
+MODEL_STATE = {
+    'emotion': ModelSlot('emotion', load_emotion_model),
+    'gemini': ModelSlot('gemini', probe_gemini, required=False),
+    'whisper': ModelSlot('whisper', load_whisper_model, required=not WHISPER_LAZY_LOAD),
+}
+
+def configure_gemini():
+    """Configure the API key and point gemini_model at the first configured model"""
+    global gemini_model
+    api_key = os.getenv("GEMINI_API_KEY", "YOUR_API_KEY_HERE")
+    genai.configure(api_key=api_key)
+    gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAMES[0])
+
+def setup_models():
+    """
+    Start loading all ML models in the background and return right away.
+    /api/ready reports when the required ones are usable.
+    """
+    print("🤖 Setting up Gemini API...")
+    configure_gemini()
+
+    MODEL_STATE['emotion'].start()
+    MODEL_STATE['gemini'].start()
+    if WHISPER_LAZY_LOAD:
+        print("🎤 Whisper will load on the first voice request")
+    else:
+        MODEL_STATE['whisper'].start()
+
+    print("🖼️ Indexing meme templates...")
+    template_index.refresh()
+    template_index.start_watching(TEMPLATE_WATCH_INTERVAL_S)
+    start_meme_gc(MEME_GC_INTERVAL_S)
+    if CAPTION_BANK_ENABLED:
+        # Load the bank now so the first meme request doesn't read SQLite
+        caption_bank.load()
+        print("🗃️ Starting caption bank filler...")
+        caption_bank.start(CAPTION_BANK_REFRESH_INTERVAL_S)
+    if MEME_RENDER_MODE == "deferred" and not os.getenv("MEME_SIGNING_KEY"):
+        print("⚠️ MEME_SIGNING_KEY not set, deferred meme links will break on restart")
 
     print("🎤 Setting local FFmpeg path...")
     ffmpeg_path = set_ffmpeg_path()
     print("✅ Local FFmpeg configured:", ffmpeg_path)
 
-    print("🎤 Loading Whisper model...")
-    whisper_model = whisper.load_model("base")
-    print("✅ Whisper model ready!")
+# ============= LONG-TEXT EMOTION ANALYSIS =============
 
-def translate_text(text):
-    """Translate Roman Urdu to English"""
-    try:
-        translated = translator.translate(text, src='ur', dest='en')
-        return translated.text
-    except Exception as e:
-        print(f"Translation error: {e}")
-        return text
+# Texts longer than one window are split into overlapping token windows
+EMOTION_WINDOW_TOKENS = int(os.getenv("EMOTION_WINDOW_TOKENS", "500"))
+EMOTION_WINDOW_OVERLAP = int(os.getenv("EMOTION_WINDOW_OVERLAP", "64"))
+# Tokens kept free per window because decoding and re-encoding a window
+# does not always reproduce the same token count
+EMOTION_WINDOW_MARGIN = 8
+# "mean" (token-weighted average over windows) or "max" (per-label peak)
+EMOTION_WINDOW_AGGREGATE = os.getenv("EMOTION_WINDOW_AGGREGATE", "mean").lower()
+EMOTION_TOP_K = int(os.getenv("EMOTION_TOP_K", "3"))
 
-def analyze_emotion(text):
-    """Analyze emotion from text"""
-    predictions = emotion_pipeline(text)
-    top_emotion = sorted(predictions[0], key=lambda x: x['score'], reverse=True)[0]
+def split_emotion_windows(text):
+    """
+    Split text into overlapping windows that each fit the model.
+    Returns (window_texts, token_counts); short texts come back whole.
+    """
+    tokenizer = emotion_tokenizer
+    if tokenizer is None:
+        return [text], [1]
+
+    model_limit = min(EMOTION_MAX_LENGTH, getattr(tokenizer, "model_max_length", EMOTION_MAX_LENGTH))
+    size = max(16, min(EMOTION_WINDOW_TOKENS, model_limit - tokenizer.num_special_tokens_to_add() - EMOTION_WINDOW_MARGIN))
+    step = max(1, size - max(0, min(EMOTION_WINDOW_OVERLAP, size // 2)))
+
+    ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+    if len(ids) <= size:
+        return [text], [max(1, len(ids))]
+
+    windows, counts = [], []
+    for start in range(0, len(ids), step):
+        piece = ids[start:start + size]
+        windows.append(tokenizer.decode(piece))
+        counts.append(len(piece))
+        if start + size >= len(ids):
+            break
+    return windows, counts
+
+def aggregate_emotion_scores(labels, score_rows, token_counts, top_k=EMOTION_TOP_K):
+    """Combine per-window score lists into one distribution and its top-k labels"""
+    scores = np.asarray(score_rows, dtype=np.float32)
+    if len(scores) == 1:
+        combined = scores[0]
+    elif EMOTION_WINDOW_AGGREGATE == "max":
+        combined = scores.max(axis=0)
+    else:
+        weights = np.asarray(token_counts, dtype=np.float32)
+        combined = weights @ scores / weights.sum()
+
+    k = max(1, min(top_k, len(labels)))
+    top = np.argpartition(-combined, k - 1)[:k]
+    top = top[np.argsort(-combined[top])]
     return {
-        'emotion': top_emotion['label'].lower(),
-        'confidence': float(top_emotion['score'])
+        'emotion': labels[top[0]].lower(),
+        'confidence': float(combined[top[0]]),
+        'top_emotions': [{'label': labels[i].lower(), 'score': float(combined[i])} for i in top],
+        'distribution': {label.lower(): float(score) for label, score in zip(labels, combined)},
+        'windows': len(scores)
     }
 
+@instrumented("emotion")
+def analyze_emotions(texts, top_k=EMOTION_TOP_K):
+    """
+    Analyze emotion for several texts. Every window of every text goes to
+    the model together, so a long entry costs one batched forward pass.
+    """
+    if not texts:
+        return []
+    MODEL_STATE['emotion'].ensure()
+    windows, spans = [], []
+    for text in texts:
+        pieces, counts = split_emotion_windows(text)
+        spans.append((len(windows), len(pieces), counts))
+        windows.extend(pieces)
+
+    if emotion_batcher.is_running():
+        results = emotion_batcher.submit_many(windows)
+    else:
+        results = emotion_pipeline(windows, batch_size=len(windows))
+
+    labels = [item['label'] for item in results[0]]
+    analyses = []
+    for start, count, token_counts in spans:
+        rows = [[item['score'] for item in result] for result in results[start:start + count]]
+        analyses.append(aggregate_emotion_scores(labels, rows, token_counts, top_k))
+    return analyses
+
+def analyze_emotion(text):
+    """Analyze emotion from text"""
+    return analyze_emotions([text])[0]
+
+# ============= EMOTION MICRO-BATCHING =============
+
+EMOTION_BATCH_MAX_SIZE = int(os.getenv("EMOTION_BATCH_MAX_SIZE", "16"))
+EMOTION_BATCH_MAX_WAIT_MS = float(os.getenv("EMOTION_BATCH_MAX_WAIT_MS", "10"))
+
+class EmotionBatcher:
+    """
+    Collects texts from concurrent requests and runs them through the
+    emotion pipeline as one batched forward pass.
+
+    A batch is flushed when it reaches max_batch_size or when the oldest
+    text has waited max_wait_ms, whichever comes first.
+    """
+
+    def __init__(self, max_batch_size=16, max_wait_ms=10):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {
+            "submitted": 0,
+            "batches": 0,
+            "items": 0,
+            "errors": 0,
+            "max_queue_depth": 0,
+            "batch_size_histogram": {},
+            "total_wait_ms": 0.0,
+            "total_inference_ms": 0.0,
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="emotion-batcher", daemon=True)
+            self._thread.start()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, text):
+        """Queue one text and block until its score list is ready"""
+        return self.submit_many([text])[0]
+
+    def submit_many(self, texts):
+        """
+        Queue several texts back to back so they land in the same batch.
+        Blocks until all are scored; returns score lists in input order.
+        """
+        futures = []
+        queued_at = time.monotonic()
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future, queued_at))
+            futures.append(future)
+        with self._lock:
+            self._stats["submitted"] += len(texts)
+            depth = self._queue.qsize()
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+        return [future.result() for future in futures]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _, _ in batch]
+            started = time.monotonic()
+
+            try:
+                results = emotion_pipeline(texts, batch_size=len(texts))
+            except Exception as e:
+                # One bad input should not fail every caller in the batch,
+                # so retry the texts one at a time.
+                print(f"Emotion batch error ({len(texts)} texts), retrying individually: {e}")
+                results = []
+                for text in texts:
+                    try:
+                        results.append(emotion_pipeline(text)[0])
+                    except Exception as item_error:
+                        results.append(item_error)
+
+            finished = time.monotonic()
+            errors = 0
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    errors += 1
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            with self._lock:
+                stats = self._stats
+                stats["batches"] += 1
+                stats["items"] += len(batch)
+                stats["errors"] += errors
+                histogram = stats["batch_size_histogram"]
+                histogram[len(batch)] = histogram.get(len(batch), 0) + 1
+                stats["total_wait_ms"] += sum((started - queued_at) * 1000 for _, _, queued_at in batch)
+                stats["total_inference_ms"] += (finished - started) * 1000
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["batch_size_histogram"] = dict(self._stats["batch_size_histogram"])
+        batches = stats["batches"] or 1
+        items = stats["items"] or 1
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_batch_size"] = round(stats["items"] / batches, 2)
+        stats["avg_wait_ms"] = round(stats.pop("total_wait_ms") / items, 2)
+        stats["avg_inference_ms"] = round(stats.pop("total_inference_ms") / batches, 2)
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait * 1000
+        return stats
+
+emotion_batcher = EmotionBatcher(EMOTION_BATCH_MAX_SIZE, EMOTION_BATCH_MAX_WAIT_MS)
+
 # ============= LINK GENERATION HELPERS =============
 
 def generate_movie_link(title):
@@ -159,22 +808,594 @@ def generate_book_link(title, author):
         'kindle': f"https://www.amazon.com/s?k={query}+kindle"
     }
 
-# ============= SAFE GEMINI CALL =============
+# ============= LLM RESPONSE CACHE =============
+
+# Bump whenever a prompt template changes so stale responses are never reused
+PROMPT_TEMPLATE_VERSION = "1"
+
+LLM_CACHE_DB_PATH = os.getenv("LLM_CACHE_DB_PATH", "llm_cache.sqlite3")
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "2048"))
+
+# Per-call-site policy: ttl in seconds (0 = never cache), disk = persist across restarts.
+# Judge verdicts for the same caption/emotion are stable, so they are kept for a week;
+# recommendations (and their judge/reflect passes) are personal and only reused briefly
+# in memory; captions should stay fresh.
+LLM_CACHE_POLICIES = {
+    "judge": {"ttl": 7 * 24 * 3600, "disk": True},
+    "judge_batch": {"ttl": 7 * 24 * 3600, "disk": True},
+    "reflect": {"ttl": 24 * 3600, "disk": True},
+    "reflect_batch": {"ttl": 24 * 3600, "disk": True},
+    "recommendations": {"ttl": 10 * 60, "disk": False},
+    "recommendation_judge": {"ttl": 10 * 60, "disk": False},
+    "recommendation_reflect": {"ttl": 10 * 60, "disk": False},
+    "entertainment": {"ttl": 10 * 60, "disk": False},
+    "captions": {"ttl": 0, "disk": False},
+}
+
+class TTLCache:
+    """Thread-safe in-memory LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+class LLMResponseCache:
+    """
+    Two-tier cache for Gemini responses: an in-memory LRU in front of a
+    SQLite table that survives restarts. Keys are a hash of the template
+    version, call site and whitespace-normalized prompt.
+    """
+
+    def __init__(self, db_path, memory_entries=2048, policies=None):
+        self.db_path = db_path
+        self.policies = policies or {}
+        self.memory = TTLCache(memory_entries)
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self._writes = 0
+
+    def policy(self, call_site):
+        return self.policies.get(call_site, {"ttl": 0, "disk": False})
+
+    @staticmethod
+    def make_key(call_site, prompt):
+        normalized = " ".join(prompt.split())
+        raw = f"{PROMPT_TEMPLATE_VERSION}\x00{call_site}\x00{normalized}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, call_site, field):
+        with self._stats_lock:
+            site = self._stats.setdefault(call_site, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0})
+            site[field] += 1
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, call_site TEXT, response TEXT, expires_at REAL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def get(self, call_site, prompt):
+        policy = self.policy(call_site)
+        if policy["ttl"] <= 0:
+            return None
+
+        key = self.make_key(call_site, prompt)
+        value = self.memory.get(key)
+        if value is not None:
+            self._count(call_site, "memory_hits")
+            return value
+
+        if policy["disk"]:
+            try:
+                with self._db_lock:
+                    row = self._connection().execute(
+                        "SELECT response, expires_at FROM llm_cache WHERE key = ?", (key,)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                print(f"LLM cache read error: {e}")
+                row = None
+            if row and row[1] > time.time():
+                self.memory.set(key, row[0], row[1] - time.time())
+                self._count(call_site, "disk_hits")
+                return row[0]
+
+        self._count(call_site, "misses")
+        return None
+
+    def set(self, call_site, prompt, response):
+        policy = self.policy(call_site)
+        if policy["ttl"] <= 0 or not response:
+            return
+
+        key = self.make_key(call_site, prompt)
+        self.memory.set(key, response, policy["ttl"])
+        self._count(call_site, "stores")
+
+        if policy["disk"]:
+            now = time.time()
+            try:
+                with self._db_lock:
+                    db = self._connection()
+                    db.execute(
+                        "INSERT OR REPLACE INTO llm_cache (key, call_site, response, expires_at) VALUES (?, ?, ?, ?)",
+                        (key, call_site, response, now + policy["ttl"])
+                    )
+                    self._writes += 1
+                    if self._writes % 500 == 0:
+                        db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                    db.commit()
+            except sqlite3.Error as e:
+                print(f"LLM cache write error: {e}")
+
+    def stats(self):
+        with self._stats_lock:
+            per_site = {site: dict(counts) for site, counts in self._stats.items()}
+        totals = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        for counts in per_site.values():
+            for field in totals:
+                totals[field] += counts[field]
+        lookups = totals["memory_hits"] + totals["disk_hits"] + totals["misses"]
+        totals["hit_rate"] = round((totals["memory_hits"] + totals["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return {
+            "prompt_template_version": PROMPT_TEMPLATE_VERSION,
+            "memory_entries": len(self.memory),
+            "totals": totals,
+            "call_sites": per_site,
+        }
+
+llm_cache = LLMResponseCache(LLM_CACHE_DB_PATH, LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_POLICIES)
+
+# ============= TRANSLATION =============
+
+TRANSLATION_CACHE_TTL_S = int(os.getenv("TRANSLATION_CACHE_TTL_S", str(24 * 3600)))
+TRANSLATION_CACHE_ENTRIES = int(os.getenv("TRANSLATION_CACHE_ENTRIES", "4096"))
+# Share of common English words needed before a Latin-script text is left untranslated
+ENGLISH_WORD_RATIO = float(os.getenv("ENGLISH_WORD_RATIO", "0.3"))
+
+translation_cache = TTLCache(TRANSLATION_CACHE_ENTRIES)
+
+# Any Urdu/Arabic-script character means the text needs translating
+ARABIC_SCRIPT_RE = re.compile(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]')
+
+# Frequent Roman Urdu words that are not also English words
+ROMAN_URDU_MARKERS = frozenset({
+    "hai", "hain", "hoon", "hun", "nahi", "nahin", "nai", "kya", "kyun", "kyu", "kaise", "kaisa",
+    "mein", "mera", "meri", "mere", "mujhe", "mujh", "tum", "tumhe", "tumhara", "aap", "apna", "apni",
+    "raha", "rahi", "rahe", "tha", "thi", "thay", "gaya", "gayi", "gaye", "karna", "karo", "kar",
+    "kr", "rha", "rhi", "bohat", "bahut", "boht", "acha", "accha", "achha", "yaar", "yar", "aur",
+    "bhi", "kuch", "sab", "abhi", "phir", "lekin", "magar", "bilkul", "theek", "thik", "udaas",
+    "udas", "khush", "pareshan", "dil", "zindagi", "pyar", "dost", "ghar", "aaj", "kal", "wala",
+    "wali", "ka", "ki", "ke", "ko", "se", "ne", "jo", "woh", "wo", "yeh", "ye", "hum", "humein",
+    "koi", "kab", "kahan", "sirf", "bas", "zara", "lag", "laga", "lagta", "lagti", "hota", "hoti",
+})
+
+ENGLISH_COMMON_WORDS = frozenset({
+    "i", "i'm", "im", "me", "my", "mine", "myself", "you", "your", "we", "our", "they", "he", "she",
+    "it", "it's", "is", "am", "are", "was", "were", "be", "been", "being", "have", "has", "had",
+    "do", "does", "did", "don't", "didn't", "can't", "cannot", "not", "no", "yes", "so", "very",
+    "really", "too", "the", "a", "an", "and", "or", "but", "if", "because", "of", "to", "in", "on",
+    "at", "for", "with", "about", "from", "this", "that", "these", "those", "what", "why", "how",
+    "when", "where", "who", "all", "just", "today", "now", "again", "always", "never", "feel",
+    "feeling", "feels", "felt", "think", "know", "want", "need", "like", "love", "hate", "get",
+    "got", "going", "go", "work", "life", "day", "time", "people", "everything", "nothing",
+    "anything", "something", "happy", "sad", "angry", "tired", "stressed", "anxious", "lonely",
+    "bored", "excited", "scared", "worried", "upset", "good", "bad", "great", "better", "worse",
+    "much", "more", "lot", "some", "any", "will", "would", "could", "should", "there", "here",
+})
+
+def is_probably_english(text):
+    """
+    Cheap local check for text that is already English.
+    Urdu script or any Roman Urdu marker word means it is not.
+    """
+    if ARABIC_SCRIPT_RE.search(text):
+        return False
+    if any(ch.isalpha() and ord(ch) > 0x024F for ch in text):
+        return False
+
+    words = re.findall(r"[a-z']+", text.lower())
+    if not words:
+        # Only digits/emoji/punctuation, nothing to translate
+        return True
+    if any(word in ROMAN_URDU_MARKERS for word in words):
+        return False
+    english_hits = sum(1 for word in words if word in ENGLISH_COMMON_WORDS)
+    return english_hits / len(words) >= ENGLISH_WORD_RATIO
+
+_translator_lock = threading.Lock()
+
+def get_translator():
+    """googletrans client, imported and created on first use"""
+    global translator
+    if translator is None:
+        with _translator_lock:
+            if translator is None:
+                from googletrans import Translator
+                translator = Translator()
+    return translator
+
+@instrumented("translate")
+def translate_text(text):
+    """Translate Roman Urdu to English"""
+    if is_probably_english(text):
+        return text
+
+    cached = translation_cache.get(text)
+    if cached is not None:
+        return cached
 
-def safe_gemini_generate(prompt, max_output_tokens=200):
-    """Wrapper to call gemini_model and return text safely."""
-    global gemini_model
     try:
-        if gemini_model is None:
-            raise RuntimeError("Gemini not configured")
-        res = gemini_model.generate_content(prompt)
+        translated = get_translator().translate(text, src='ur', dest='en')
+        translation_cache.set(text, translated.text, TRANSLATION_CACHE_TTL_S)
+        return translated.text
+    except Exception as e:
+        print(f"Translation error: {e}")
+        return text
+
+@instrumented("translate_batch")
+def translate_texts(texts):
+    """
+    Batch version of translate_text() for multi-text callers.
+    English and cached texts are resolved locally; the remaining unique
+    texts go to googletrans in a single call.
+    """
+    results = list(texts)
+    to_translate = {}
+    for i, text in enumerate(texts):
+        if is_probably_english(text):
+            continue
+        cached = translation_cache.get(text)
+        if cached is not None:
+            results[i] = cached
+        else:
+            to_translate.setdefault(text, []).append(i)
+
+    if not to_translate:
+        return results
+
+    unique_texts = list(to_translate)
+    try:
+        translated = get_translator().translate(unique_texts, src='ur', dest='en')
+        translations = [t.text for t in translated]
+        for text, translation in zip(unique_texts, translations):
+            translation_cache.set(text, translation, TRANSLATION_CACHE_TTL_S)
+    except Exception as e:
+        # translate_text() caches its own successes; its error fallback is the
+        # untranslated input, which must not be cached
+        print(f"Batch translation error, translating one by one: {e}")
+        translations = [translate_text(text) for text in unique_texts]
+
+    for text, translation in zip(unique_texts, translations):
+        for i in to_translate[text]:
+            results[i] = translation
+    return results
+
+# ============= SAFE GEMINI CALL =============
+
+# Per-attempt timeout and whole-call deadline (attempts + retries + backoff)
+GEMINI_TIMEOUT_S = float(os.getenv("GEMINI_TIMEOUT_S", "15"))
+GEMINI_DEADLINE_S = float(os.getenv("GEMINI_DEADLINE_S", "25"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "1"))
+GEMINI_RETRY_BASE_S = float(os.getenv("GEMINI_RETRY_BASE_S", "0.5"))
+GEMINI_RETRY_MAX_S = float(os.getenv("GEMINI_RETRY_MAX_S", "4"))
+# Calls in flight at once; a stalled call holds its thread until the SDK returns
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+# Attempts allowed to wait for a free thread; beyond that calls fail fast
+GEMINI_MAX_QUEUED = int(os.getenv("GEMINI_MAX_QUEUED", "16"))
+# Open the circuit after this many consecutive failures, retry after the cooldown
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_COOLDOWN_S = float(os.getenv("GEMINI_BREAKER_COOLDOWN_S", "30"))
+# Hedging: start a second attempt when the first is slower than this
+# percentile of recent latencies for the call site (needs enough samples)
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "0") == "1"
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+# Model for the hedged attempt; empty reuses the primary model
+GEMINI_HEDGE_MODEL = os.getenv("GEMINI_HEDGE_MODEL", "")
+
+# Generation limits per call site. 2.5 models spend their thinking tokens from
+# max_output_tokens, so these are far above the visible answer length.
+GEMINI_CALL_POLICIES = {
+    "judge": {"max_output_tokens": 2048, "temperature": 0.0, "timeout": 12},
+    "judge_batch": {"max_output_tokens": 4096, "temperature": 0.0, "timeout": 20},
+    "reflect": {"max_output_tokens": 1024, "timeout": 12},
+    "reflect_batch": {"max_output_tokens": 2048, "timeout": 15},
+    "captions": {"max_output_tokens": 1024, "temperature": 1.0, "timeout": 12},
+    "recommendations": {"max_output_tokens": 2048, "timeout": 15},
+    "recommendation_judge": {"max_output_tokens": 2048, "temperature": 0.0, "timeout": 12},
+    "recommendation_reflect": {"max_output_tokens": 1024, "timeout": 12},
+    "entertainment": {"max_output_tokens": 1024, "timeout": 12},
+}
+GEMINI_DEFAULT_POLICY = {"max_output_tokens": 2048, "timeout": GEMINI_TIMEOUT_S}
+
+# Errors worth retrying (matched by class name so google.api_core stays optional)
+RETRYABLE_GEMINI_ERRORS = {
+    "TimeoutError", "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout", "Aborted", "Unknown", "RetryError", "ConnectionError",
+}
+
+class GeminiUnavailableError(RuntimeError):
+    """The circuit breaker is open, so the call was not attempted"""
+
+class GeminiSaturatedError(RuntimeError):
+    """Every Gemini thread is busy and the wait queue is full"""
+
+def is_retryable_gemini_error(error):
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in RETRYABLE_GEMINI_ERRORS
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive failures; after
+    cooldown_s one trial call is let through (half-open) and its result
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold, cooldown_s):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_s = cooldown_s
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown_s:
+                self.state = "half_open"
+                return True
+            return False
+
+    def available(self):
+        """
+        Whether allow() would let a call through right now, without taking
+        the half-open trial slot (that is left to the call itself)
+        """
+        with self._lock:
+            if self.state == "open":
+                return time.monotonic() - self._opened_at >= self.cooldown_s
+            return self.state == "closed"
+
+    def release_trial(self):
+        """
+        Give back a half-open trial slot when the trial never reached Gemini,
+        so the next call can try instead; counts as neither success nor failure
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"⚡ Gemini circuit open for {self.cooldown_s:g}s after {self._failures} failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+class GeminiClient:
+    """
+    generate_content() with a deadline per attempt and per call, jittered
+    retries, a circuit breaker and optional hedged attempts.
+    """
+
+    def __init__(self, max_workers, breaker, max_queued=16):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.breaker = breaker
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._latencies = {}
+        self._latency_lock = threading.Lock()
+        self._hedge_model = None
+
+    def _call(self, model, prompt, generation_config, call_site, deadline):
+        started = time.monotonic()
+        if started >= deadline:
+            raise TimeoutError(f"Gemini call ({call_site}) missed its deadline")
+        # Bound the SDK request too, so a stalled call frees its thread
+        res = model.generate_content(prompt, generation_config=generation_config,
+                                     request_options={"timeout": deadline - started})
         text = getattr(res, "text", None)
         if text is None:
             text = str(res)
+        with self._latency_lock:
+            window = self._latencies.setdefault(call_site, deque(maxlen=200))
+            window.append(time.monotonic() - started)
         return text.strip()
+
+    def hedge_delay(self, call_site):
+        """Latency percentile of recent successful calls, or None until warmed up"""
+        with self._latency_lock:
+            window = sorted(self._latencies.get(call_site, ()))
+        if len(window) < GEMINI_HEDGE_MIN_SAMPLES:
+            return None
+        index = min(len(window) - 1, int(len(window) * GEMINI_HEDGE_PERCENTILE / 100))
+        return window[index]
+
+    def hedge_model(self):
+        if not GEMINI_HEDGE_MODEL:
+            return gemini_model
+        if self._hedge_model is None:
+            self._hedge_model = genai.GenerativeModel(GEMINI_HEDGE_MODEL)
+        return self._hedge_model
+
+    def _finished(self, future):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    def _submit(self, model, prompt, generation_config, call_site, deadline, limit):
+        """Submit an attempt unless `limit` attempts are already in flight; returns None if so"""
+        with self._in_flight_lock:
+            if self._in_flight >= limit:
+                return None
+            self._in_flight += 1
+        future = self.executor.submit(self._call, model, prompt, generation_config, call_site, deadline)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _attempt(self, prompt, generation_config, call_site, deadline):
+        """One attempt, possibly hedged. Returns text or raises the failure."""
+        primary = self._submit(gemini_model, prompt, generation_config, call_site, deadline,
+                               self.max_workers + self.max_queued)
+        if primary is None:
+            raise GeminiSaturatedError("Gemini client is saturated")
+        pending = {primary}
+
+        try:
+            delay = self.hedge_delay(call_site) if GEMINI_HEDGE else None
+            if delay is not None and time.monotonic() + delay < deadline:
+                done, _ = wait(pending, timeout=delay)
+                if not done:
+                    # Only hedge onto an idle thread; queueing the twin would not help
+                    hedge = self._submit(self.hedge_model(), prompt, generation_config, call_site, deadline,
+                                         self.max_workers)
+                    if hedge is not None:
+                        gemini_hedges.inc(call_site=call_site, result="started")
+                        pending.add(hedge)
+
+            error = None
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is not primary:
+                            gemini_hedges.inc(call_site=call_site, result="won")
+                        return future.result()
+                    error = future.exception()
+            if pending or error is None:
+                raise TimeoutError(f"Gemini call ({call_site}) missed its deadline")
+            raise error
+        finally:
+            # Drop attempts still queued so stale prompts never reach Gemini; one
+            # already running keeps its thread until the SDK returns
+            for future in pending:
+                future.cancel()
+
+    def generate(self, prompt, call_site=None, max_output_tokens=None):
+        site = call_site or "uncached"
+        policy = GEMINI_CALL_POLICIES.get(call_site, GEMINI_DEFAULT_POLICY)
+        generation_config = {"max_output_tokens": max_output_tokens or policy["max_output_tokens"]}
+        if "temperature" in policy:
+            generation_config["temperature"] = policy["temperature"]
+
+        if not self.breaker.allow():
+            raise GeminiUnavailableError("Gemini circuit is open")
+
+        deadline = time.monotonic() + GEMINI_DEADLINE_S
+        attempt = 0
+        while True:
+            attempt_deadline = min(deadline, time.monotonic() + policy.get("timeout", GEMINI_TIMEOUT_S))
+            try:
+                text = self._attempt(prompt, generation_config, site, attempt_deadline)
+                self.breaker.record_success()
+                return text
+            except GeminiSaturatedError:
+                # Local back-pressure says nothing about Gemini's health, but a
+                # half-open trial that never ran must free its slot
+                self.breaker.release_trial()
+                raise
+            except Exception as e:
+                if not is_retryable_gemini_error(e):
+                    # Bad request or blocked output: Gemini itself is reachable
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                backoff = random.uniform(0, min(GEMINI_RETRY_MAX_S, GEMINI_RETRY_BASE_S * 2 ** attempt))
+                if attempt >= GEMINI_MAX_RETRIES or time.monotonic() + backoff >= deadline or not self.breaker.allow():
+                    raise
+            attempt += 1
+            gemini_retries.inc(call_site=site)
+            time.sleep(backoff)
+
+gemini_client = GeminiClient(
+    GEMINI_MAX_CONCURRENCY, CircuitBreaker(GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_COOLDOWN_S), GEMINI_MAX_QUEUED
+)
+
+def safe_gemini_generate(prompt, max_output_tokens=None, call_site=None):
+    """
+    Wrapper to call gemini_model and return text safely (None on failure,
+    so callers fall back to their default texts).
+    call_site selects the LLM_CACHE_POLICIES entry used to cache the response
+    and the GEMINI_CALL_POLICIES generation limits and timeout.
+    """
+    site = call_site or "uncached"
+    if call_site:
+        cached = llm_cache.get(call_site, prompt)
+        if cached is not None:
+            gemini_calls.inc(call_site=site, outcome="cache_hit")
+            return cached
+
+    if gemini_model is None:
+        gemini_calls.inc(call_site=site, outcome="error")
+        print("Gemini generate error: Gemini not configured")
+        return None
+
+    started = time.perf_counter()
+    try:
+        text = gemini_client.generate(prompt, call_site, max_output_tokens)
+    except GeminiUnavailableError:
+        gemini_calls.inc(call_site=site, outcome="circuit_open")
+        return None
+    except GeminiSaturatedError:
+        gemini_calls.inc(call_site=site, outcome="saturated")
+        print("Gemini generate skipped: client saturated")
+        return None
+    except TimeoutError as e:
+        gemini_calls.inc(call_site=site, outcome="timeout")
+        print(f"Gemini generate timeout: {e}")
+        return None
     except Exception as e:
+        gemini_calls.inc(call_site=site, outcome="error")
         print(f"Gemini generate error: {e}")
         return None
+    finally:
+        gemini_seconds.observe(time.perf_counter() - started, call_site=site)
+    gemini_calls.inc(call_site=site, outcome="ok")
+
+    if call_site:
+        llm_cache.set(call_site, prompt, text)
+    return text
 
 # ============= ENHANCED JUDGING WITH EXPLAINABILITY =============
 
@@ -184,7 +1405,6 @@ def extract_score(line):
         parts = line.split(":", 1)
         if len(parts) > 1:
             score_str = parts[1].strip()
-            import re
             numbers = re.findall(r'\d+\.?\d*', score_str)
             if numbers:
                 return float(numbers[0])
@@ -250,34 +1470,58 @@ def parse_judge_response(response_text):
 
 def log_judge_breakdown(judge_info, candidate_text):
     """
-    Pretty-print the judge breakdown for logging/debugging.
-    Helpful for developers to understand scoring.
+    Record the judge score, and for a sampled share of calls log the full
+    scoring breakdown as one structured debug record.
     """
-    print("\n" + "="*70)
-    print("🔍 JUDGE SCORING BREAKDOWN")
-    print("="*70)
-    print(f"📝 Candidate: \"{candidate_text}\"")
-    print("-" * 70)
-
-    for criterion, data in judge_info.get("criteria_breakdown", {}).items():
-        score = data.get("score", "N/A")
-        reason = data.get("reason", "No reason provided")
-        print(f"✓ {criterion.upper()}: {score}/2.5")
-        print(f"  └─ {reason}")
+    total = judge_info.get("total_score")
+    if isinstance(total, (int, float)):
+        judge_scores.observe(total)
+    if not judge_log_sampled():
+        return
+    judge_logger.debug(json.dumps({
+        "step": "judge_breakdown",
+        "candidate": candidate_text,
+        "total_score": total,
+        "criteria": {
+            criterion: {"score": data.get("score"), "reason": data.get("reason")}
+            for criterion, data in judge_info.get("criteria_breakdown", {}).items()
+        },
+        "overall_critique": judge_info.get("overall_critique")
+    }, ensure_ascii=False))
 
-    total = judge_info.get("total_score", "N/A")
-    critique = judge_info.get("overall_critique", "No critique")
-    print("-" * 70)
-    print(f"📊 TOTAL SCORE: {total}/10")
-    print(f"💬 OVERALL: {critique}")
-    print("="*70 + "\n")
+def build_judge_info(parsed, judge_raw):
+    """Shape a parsed judge block into the judge_info dict used by callers"""
+    return {
+        "total_score": parsed.get("total_score"),
+        "criteria_breakdown": {
+            "tone": {
+                "score": parsed.get("tone_score"),
+                "reason": parsed.get("tone_reason")
+            },
+            "relevance": {
+                "score": parsed.get("relevance_score"),
+                "reason": parsed.get("relevance_reason")
+            },
+            "appropriateness": {
+                "score": parsed.get("appropriateness_score"),
+                "reason": parsed.get("appropriateness_reason")
+            },
+            "safety": {
+                "score": parsed.get("safety_score"),
+                "reason": parsed.get("safety_reason")
+            }
+        },
+        "overall_critique": parsed.get("overall_critique"),
+        "judge_raw": judge_raw
+    }
 
-def judge_and_reflect_with_explanation(candidate_text, context_prompt, critique_instructions, emotion, score_threshold=7):
+def judge_caption(candidate_text, context_prompt, emotion, call_site="judge"):
     """
     Enhanced judge with detailed scoring breakdown and reasoning.
     Judges on: TONE, RELEVANCE, APPROPRIATENESS, SAFETY (each 2.5 points = 10 total)
-    
-    Returns: (improved_text, judge_info)
+    call_site picks the cache policy, so personal text is not persisted.
+
+    Returns: judge_info (total_score is None when the judge failed)
     """
     judge_prompt = f"""
 You are an expert judge for meme caption quality. Context:
@@ -312,50 +1556,31 @@ TOTAL_SCORE: <number>
 OVERALL_CRITIQUE: <critique if score < 7, else "Good caption">
 """
 
-    judge_response = safe_gemini_generate(judge_prompt)
+    judge_response = safe_gemini_generate(judge_prompt, call_site=call_site)
     log_reflexion("JUDGE OUTPUT WITH 4 CRITERIA", judge_response)
 
     if not judge_response:
-        return candidate_text, {
+        return {
             "total_score": None,
             "criteria_breakdown": {},
             "judge_raw": None
         }
 
     # Parse structured output
-    parsed = parse_judge_response(judge_response)
-    judge_info = {
-        "total_score": parsed.get("total_score"),
-        "criteria_breakdown": {
-            "tone": {
-                "score": parsed.get("tone_score"),
-                "reason": parsed.get("tone_reason")
-            },
-            "relevance": {
-                "score": parsed.get("relevance_score"),
-                "reason": parsed.get("relevance_reason")
-            },
-            "appropriateness": {
-                "score": parsed.get("appropriateness_score"),
-                "reason": parsed.get("appropriateness_reason")
-            },
-            "safety": {
-                "score": parsed.get("safety_score"),
-                "reason": parsed.get("sfety_reason")
-            }
-        },
-        "overall_critique": parsed.get("overall_critique"),
-        "judge_raw": judge_response
-    }
-
-    total_score = parsed.get("total_score")
+    judge_info = build_judge_info(parse_judge_response(judge_response), judge_response)
 
     # Log the breakdown
     log_judge_breakdown(judge_info, candidate_text)
-
-    # If score is low, apply reflection
-    if total_score is None or (isinstance(total_score, (int, float)) and total_score < score_threshold):
-        reflect_prompt = f"""
+    return judge_info
+
+def reflect_caption(candidate_text, judge_info, context_prompt, critique_instructions, emotion, call_site="reflect"):
+    """Rewrite a caption using the judge's per-criterion feedback. Returns None on failure."""
+    breakdown = judge_info.get("criteria_breakdown") or {}
+    reasons = {
+        key: (breakdown.get(key) or {}).get("reason")
+        for key in ("tone", "relevance", "appropriateness", "safety")
+    }
+    reflect_prompt = f"""
 Context: {context_prompt}
 Emotion: {emotion}
 
@@ -363,31 +1588,404 @@ Original caption:
 \"\"\"{candidate_text}\"\"\"
 
 Judge's detailed feedback:
-- TONE Issue: {judge_info['criteria_breakdown']['tone']['reason']}
-- RELEVANCE Issue: {judge_info['criteria_breakdown']['relevance']['reason']}
-- APPROPRIATENESS Issue: {judge_info['criteria_breakdown']['appropriateness']['reason']}
-- SAFETY Issue: {judge_info['criteria_breakdown']['safety']['reason']}
+- TONE Issue: {reasons['tone']}
+- RELEVANCE Issue: {reasons['relevance']}
+- APPROPRIATENESS Issue: {reasons['appropriateness']}
+- SAFETY Issue: {reasons['safety']}
 
 Reflection instructions:
 {critique_instructions}
 
 Rewrite and improve the caption addressing EACH issue above. Keep the result short (max 10 words) and directly usable as a meme caption.
 """
-        reflected = safe_gemini_generate(reflect_prompt)
-        log_reflexion("REFLECTION APPLIED (TONE+RELEVANCE+APPROPRIATENESS+SAFETY)", reflected)
+    reflected = safe_gemini_generate(reflect_prompt, call_site=call_site)
+    log_reflexion("REFLECTION APPLIED (TONE+RELEVANCE+APPROPRIATENESS+SAFETY)", reflected)
+    return reflected.strip() if reflected else None
 
-        if reflected:
-            return reflected.strip(), judge_info
-        else:
-            return candidate_text, judge_info
+@instrumented("judge_reflect")
+def judge_and_reflect_with_explanation(candidate_text, context_prompt, critique_instructions, emotion, score_threshold=7,
+                                       judge_call_site="judge", reflect_call_site="reflect"):
+    """
+    Judge a caption and, if the score is missing or below score_threshold,
+    rewrite it once with the judge's feedback.
+
+    Returns: (improved_text, judge_info)
+    """
+    judge_info = judge_caption(candidate_text, context_prompt, emotion, call_site=judge_call_site)
+    if judge_info["judge_raw"] is None:
+        return candidate_text, judge_info
+
+    total_score = judge_info.get("total_score")
+    if total_score is None or (isinstance(total_score, (int, float)) and total_score < score_threshold):
+        reflected = reflect_caption(candidate_text, judge_info, context_prompt, critique_instructions, emotion,
+                                    call_site=reflect_call_site)
+        return reflected or candidate_text, judge_info
 
     log_reflexion("REFLECTION SKIPPED (GOOD SCORE)", candidate_text)
     return candidate_text, judge_info
 
+# ============= BATCH JUDGING (ONE CALL FOR ALL CANDIDATES) =============
+
+# A judge block header is a line holding only "CANDIDATE <n>" (markdown/colon allowed),
+# so reason text such as "Candidate 2 is funnier because..." is never a header
+CANDIDATE_HEADER_RE = re.compile(r'^[\W_]*CANDIDATE\s*#?\s*(\d+)[\W_]*$', re.IGNORECASE)
+# A reflection line is "CANDIDATE <n>: <caption>"; the separator is required
+CANDIDATE_LINE_RE = re.compile(r'^[\W_]*CANDIDATE\s*#?\s*(\d+)\s*\**\s*[:\-\u2013.)][\s*]*(.+)$', re.IGNORECASE)
+
+def parse_batch_judge_response(response_text, count):
+    """
+    Split a multi-candidate judge response on its CANDIDATE <n> headers and
+    parse each block with parse_judge_response().
+    Returns a list of `count` parsed dicts; candidates missing from the
+    response get None for every field.
+    Only the first header for each number in 1..count starts a block; any
+    other header-like line stays part of the current block.
+    """
+    blocks = {}
+    current = None
+    for line in response_text.splitlines():
+        header = CANDIDATE_HEADER_RE.match(line.strip())
+        if header and 1 <= int(header.group(1)) <= count and int(header.group(1)) not in blocks:
+            current = int(header.group(1))
+            blocks[current] = []
+            continue
+        if current is not None:
+            blocks[current].append(line)
+
+    return [parse_judge_response("\n".join(blocks.get(i + 1, []))) for i in range(count)]
+
+def parse_batch_reflection_response(response_text):
+    """
+    Parse `CANDIDATE <n>: <caption>` lines from a batch reflection response.
+    Returns {candidate_index (0-based): rewritten caption}.
+    """
+    rewrites = {}
+    for line in response_text.splitlines():
+        header = CANDIDATE_LINE_RE.match(line.strip())
+        if not header:
+            continue
+        caption = header.group(2).strip().strip('*"\'').strip()
+        if caption:
+            rewrites[int(header.group(1)) - 1] = caption
+    return rewrites
+
+@instrumented("judge_reflect_batch")
+def judge_and_reflect_batch(candidates, context_prompt, critique_instructions, emotion, score_threshold=7):
+    """
+    Batch variant of judge_and_reflect_with_explanation().
+    Scores every candidate in a single judge call, then rewrites all of the
+    low scorers in a single reflection call.
+
+    Returns: list of (improved_text, judge_info), one per candidate, in order
+    """
+    if not candidates:
+        return []
+
+    candidate_lines = "\n".join(
+        f'CANDIDATE {i + 1}: \"\"\"{cand}\"\"\"' for i, cand in enumerate(candidates)
+    )
+    judge_prompt = f"""
+You are an expert judge for meme caption quality. Context:
+{context_prompt}
+
+Candidate Captions:
+{candidate_lines}
+
+Instructions to the judge:
+1. Evaluate EACH candidate separately ONLY on these 4 criteria (each worth 2.5 points, total 10):
+   - TONE: Does the caption match the {emotion} emotion and sound natural? (0-2.5)
+   - RELEVANCE: Does it relate to the context and user's emotional state? (0-2.5)
+   - APPROPRIATENESS: Is it family-friendly, respectful, and not offensive? (0-2.5)
+   - SAFETY: Non-offensive, non-triggering, emotionally safe
+
+2. For each criterion, provide a brief reason (1-2 sentences max).
+
+3. Give each candidate a total numerical score from 1-10.
+
+4. Provide overall critique summarizing main issues if score is below 7.
+
+Format EXACTLY as follows, one block per candidate in the same order (no variations):
+CANDIDATE <number>
+TONE_SCORE: <number>
+TONE_REASON: <reason>
+RELEVANCE_SCORE: <number>
+RELEVANCE_REASON: <reason>
+APPROPRIATENESS_SCORE: <number>
+APPROPRIATENESS_REASON: <reason>
+SAFETY_SCORE: <number>
+SAFETY_REASON: <reason>
+TOTAL_SCORE: <number>
+OVERALL_CRITIQUE: <critique if score < 7, else "Good caption">
+"""
+
+    judge_response = safe_gemini_generate(judge_prompt, call_site="judge_batch")
+    log_reflexion(f"BATCH JUDGE OUTPUT ({len(candidates)} CANDIDATES)", judge_response)
+
+    if not judge_response:
+        return [
+            (cand, {"total_score": None, "criteria_breakdown": {}, "judge_raw": None})
+            for cand in candidates
+        ]
+
+    results = []
+    low_scorers = []
+    for i, (cand, parsed) in enumerate(zip(candidates, parse_batch_judge_response(judge_response, len(candidates)))):
+        judge_info = build_judge_info(parsed, judge_response)
+        log_judge_breakdown(judge_info, cand)
+        results.append((cand, judge_info))
+
+        total_score = parsed.get("total_score")
+        if total_score is None or total_score < score_threshold:
+            low_scorers.append(i)
+
+    if not low_scorers:
+        log_reflexion("BATCH REFLECTION SKIPPED (ALL GOOD SCORES)", "\n".join(candidates))
+        return results
+
+    feedback_blocks = []
+    for i in low_scorers:
+        cand, judge_info = results[i]
+        breakdown = judge_info["criteria_breakdown"]
+        feedback_blocks.append(f"""CANDIDATE {i + 1}:
+Original caption: \"\"\"{cand}\"\"\"
+Judge's detailed feedback:
+- TONE Issue: {breakdown['tone']['reason']}
+- RELEVANCE Issue: {breakdown['relevance']['reason']}
+- APPROPRIATENESS Issue: {breakdown['appropriateness']['reason']}
+- SAFETY Issue: {breakdown['safety']['reason']}""")
+    feedback_text = "\n\n".join(feedback_blocks)
+
+    reflect_prompt = f"""
+Context: {context_prompt}
+Emotion: {emotion}
+
+The captions below scored low with the judge.
+
+{feedback_text}
+
+Reflection instructions:
+{critique_instructions}
+
+Rewrite and improve EACH caption above addressing EACH of its issues. Keep every result short (max 10 words) and directly usable as a meme caption.
+Format EXACTLY as follows, one line per caption listed above (no variations):
+CANDIDATE <number>: <improved caption>
+"""
+    reflected = safe_gemini_generate(reflect_prompt, call_site="reflect_batch")
+    log_reflexion(f"BATCH REFLECTION APPLIED ({len(low_scorers)} CANDIDATES)", reflected)
+
+    if reflected:
+        rewrites = parse_batch_reflection_response(reflected)
+        for i in low_scorers:
+            if rewrites.get(i):
+                results[i] = (rewrites[i], results[i][1])
+
+    return results
+
 # ============= CAPTION GENERATION =============
 
-def generate_humorous_captions(emotion, user_text):
-    """Generate 2 short, humorous Roman Urdu captions with reflexion based on 4 criteria"""
+CAPTION_JUDGE_MAX_WORKERS = int(os.getenv("CAPTION_JUDGE_MAX_WORKERS", "8"))
+CAPTION_JUDGE_DEADLINE_S = float(os.getenv("CAPTION_JUDGE_DEADLINE_S", "20"))
+# "adaptive": rank candidates locally, judge in rank order and stop once
+#             CAPTION_TARGET_PASSING clear the threshold (see judge_candidates_adaptive)
+# "batch": one judge call + at most one reflection call for all candidates
+# "parallel": one judge/reflexion round per candidate, run concurrently
+CAPTION_JUDGE_MODE = os.getenv("CAPTION_JUDGE_MODE", "adaptive").lower()
+CAPTION_SCORE_THRESHOLD = float(os.getenv("CAPTION_SCORE_THRESHOLD", "7"))
+CAPTION_TARGET_PASSING = int(os.getenv("CAPTION_TARGET_PASSING", "2"))
+# Most judge + reflection Gemini calls the adaptive policy makes per request
+CAPTION_LLM_BUDGET = int(os.getenv("CAPTION_LLM_BUDGET", "3"))
+# Candidates judged concurrently per adaptive round
+CAPTION_JUDGE_WAVE = int(os.getenv("CAPTION_JUDGE_WAVE", "2"))
+CAPTION_BANNED_WORDS = {
+    word.strip().lower()
+    for word in os.getenv(
+        "CAPTION_BANNED_WORDS",
+        "suicide,khudkushi,kill,marna,maut,nafrat,hate,idiot,stupid,bewakoof,gadha,kutta,kameena"
+    ).split(",")
+    if word.strip()
+}
+
+DEFAULT_CAPTIONS = ("Smile kar lo zara", "Zindagi aik meme hai, enjoy kar lo")
+
+judge_executor = ThreadPoolExecutor(max_workers=CAPTION_JUDGE_MAX_WORKERS, thread_name_prefix="caption-judge")
+
+CAPTION_WORD_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+def local_caption_score(caption):
+    """
+    Cheap 0-10 pre-score used to rank candidates before any judge call:
+    length, Roman (Latin) script, banned words and repetition.
+    Returns (score, issues); a score of 0 means the caption is rejected.
+    """
+    words = CAPTION_WORD_RE.findall(caption.lower())
+    if not words:
+        return 0.0, ["empty"]
+    if CAPTION_BANNED_WORDS.intersection(words):
+        return 0.0, ["banned_word"]
+
+    score, issues = 10.0, []
+    if len(words) < 3 or len(words) > 10:
+        score -= 2 if 2 <= len(words) <= 12 else 4
+        issues.append("length")
+
+    letters = [ch for ch in caption if ch.isalpha()]
+    non_latin = sum(1 for ch in letters if not ch.isascii())
+    if non_latin:
+        score -= 4 * non_latin / len(letters) + 1
+        issues.append("script")
+    if "#" in caption or any(ord(ch) >= 0x2600 for ch in caption):
+        score -= 1.5
+        issues.append("hashtag_or_emoji")
+
+    # Particles like "ki"/"ka" legitimately recur; stutters and 3+ repeats don't
+    repeated = sum(1 for a, b in zip(words, words[1:]) if a == b)
+    repeated += sum(words.count(word) - 2 for word in set(words) if words.count(word) > 2)
+    if repeated:
+        score -= min(3.0, 1.5 * repeated)
+        issues.append("repetition")
+    return max(score, 0.5), issues
+
+def judge_candidates_adaptive(candidates, context_prompt, critique_instructions, emotion):
+    """
+    Early-exit judging: rank candidates with local_caption_score(), judge
+    them in rank order CAPTION_JUDGE_WAVE at a time and stop as soon as
+    CAPTION_TARGET_PASSING have cleared CAPTION_SCORE_THRESHOLD. Judging never
+    uses the part of the CAPTION_LLM_BUDGET needed to reflect the failures
+    seen so far; if too few pass, the best failed ones are reflected with
+    what is left. Candidates never judged keep their text with a
+    total_score of None.
+
+    Returns: list of (final_text, judge_info), one per candidate, in order
+    """
+    deadline = time.monotonic() + CAPTION_JUDGE_DEADLINE_S
+    local = [local_caption_score(cand) for cand in candidates]
+    outcomes = [
+        (cand, {"total_score": None, "local_score": score, "local_issues": issues, "fate": "skipped"})
+        for cand, (score, issues) in zip(candidates, local)
+    ]
+    for i, (score, _) in enumerate(local):
+        if score == 0:
+            outcomes[i][1]["fate"] = "rejected"
+
+    ranked = sorted((i for i, (score, _) in enumerate(local) if score > 0), key=lambda i: -local[i][0])
+    budget = CAPTION_LLM_BUDGET
+    passing, failed = [], []
+
+    def run_round(fn, indices):
+        """Run fn(index) concurrently for a round; returns {index: result} for those done in time"""
+        futures = {judge_executor.submit(fn, i): i for i in indices}
+        done, _ = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        results = {}
+        for future, i in futures.items():
+            if future not in done:
+                future.cancel()
+                print(f"   ⏱️ Missed {CAPTION_JUDGE_DEADLINE_S:g}s judge deadline, keeping unjudged text: {candidates[i]}")
+            elif future.exception() is not None:
+                print(f"   ⚠️ Judge failed: {future.exception()}")
+            else:
+                results[i] = future.result()
+        return results
+
+    while ranked and len(passing) < CAPTION_TARGET_PASSING and time.monotonic() < deadline:
+        needed = CAPTION_TARGET_PASSING - len(passing)
+        # Keep enough budget to reflect the failures we already have
+        reserve = min(needed, len(failed))
+        wave = ranked[:max(0, min(max(1, CAPTION_JUDGE_WAVE), budget - reserve, needed))]
+        if not wave:
+            break
+        ranked = ranked[len(wave):]
+        budget -= len(wave)
+        judged = run_round(lambda i: judge_caption(candidates[i], context_prompt, emotion), wave)
+        for i in wave:
+            judge_info = judged.get(i) or {"total_score": None}
+            judge_info.update(local_score=local[i][0], local_issues=local[i][1])
+            total = judge_info.get("total_score")
+            if total is not None and total >= CAPTION_SCORE_THRESHOLD:
+                judge_info["fate"] = "passed"
+                passing.append(i)
+            else:
+                judge_info["fate"] = "failed"
+                # Only a caption the judge actually saw has feedback worth reflecting on
+                if judge_info.get("judge_raw"):
+                    failed.append(i)
+            outcomes[i] = (candidates[i], judge_info)
+
+    reflect = sorted(failed, key=lambda i: -(outcomes[i][1].get("total_score") or 0))
+    reflect = reflect[:min(budget, CAPTION_TARGET_PASSING - len(passing))]
+    if reflect and time.monotonic() < deadline:
+        rewrites = run_round(
+            lambda i: reflect_caption(candidates[i], outcomes[i][1], context_prompt, critique_instructions, emotion),
+            reflect
+        )
+        for i, text in rewrites.items():
+            if text:
+                outcomes[i][1]["fate"] = "reflected"
+                outcomes[i] = (text, outcomes[i][1])
+
+    for _, judge_info in outcomes:
+        caption_candidates.inc(mode="adaptive", fate=judge_info["fate"])
+    return outcomes
+
+@instrumented("caption_judging")
+def judge_caption_candidates(candidates, context_prompt, critique_instructions, emotion):
+    """
+    Judge/reflect caption candidates according to CAPTION_JUDGE_MODE.
+    Anything still running at the deadline keeps its unjudged text
+    (scored 0, same as a failed judge).
+
+    Returns: list of (final_text, judge_info), one per candidate, in order
+    """
+    if CAPTION_JUDGE_MODE == "adaptive":
+        return judge_candidates_adaptive(candidates, context_prompt, critique_instructions, emotion)
+
+    # Fallbacks for the batch and parallel modes below
+    unjudged = [(cand, {"total_score": None}) for cand in candidates]
+
+    if CAPTION_JUDGE_MODE == "batch":
+        future = judge_executor.submit(
+            judge_and_reflect_batch,
+            candidates, context_prompt, critique_instructions, emotion, score_threshold=CAPTION_SCORE_THRESHOLD
+        )
+        done, _ = wait([future], timeout=CAPTION_JUDGE_DEADLINE_S)
+        if future not in done:
+            future.cancel()
+            print(f"   ⏱️ Missed {CAPTION_JUDGE_DEADLINE_S:g}s batch judge deadline, keeping unjudged text")
+            return unjudged
+        if future.exception() is not None:
+            print(f"   ⚠️ Batch judge failed: {future.exception()}")
+            return unjudged
+        return future.result()
+
+    futures = [
+        judge_executor.submit(
+            judge_and_reflect_with_explanation,
+            cand, context_prompt, critique_instructions, emotion, score_threshold=CAPTION_SCORE_THRESHOLD
+        )
+        for cand in candidates
+    ]
+    done, _ = wait(futures, timeout=CAPTION_JUDGE_DEADLINE_S)
+
+    outcomes = []
+    for fallback, future in zip(unjudged, futures):
+        if future not in done:
+            future.cancel()
+            print(f"   ⏱️ Missed {CAPTION_JUDGE_DEADLINE_S:g}s judge deadline, keeping unjudged text: {fallback[0]}")
+            outcomes.append(fallback)
+        elif future.exception() is not None:
+            print(f"   ⚠️ Judge failed: {future.exception()}")
+            outcomes.append(fallback)
+        else:
+            outcomes.append(future.result())
+    return outcomes
+
+def generate_scored_captions(emotion, user_text):
+    """
+    Generate 4 Roman Urdu caption candidates and judge/reflect them.
+
+    Returns: (raw_response, scored) where scored holds one dict per
+    candidate (original, final, score, local_score), best first;
+    (None, []) when Gemini gave no response
+    """
     prompt = f"""
 Generate 4 short, humorous and funny Roman Urdu captions that fit this mood.
 - Keep each caption to one short sentence or phrase (<=10 words).
@@ -397,13 +1995,9 @@ Generate 4 short, humorous and funny Roman Urdu captions that fit this mood.
 - Label each caption on its own line (no numbering required).
 Context: emotion = {emotion}; user_text = \"{user_text}\"
 """
-    text = safe_gemini_generate(prompt)
+    text = safe_gemini_generate(prompt, call_site="captions")
     if not text:
-        base_caps = ["Smile kar lo zara", "Zindagi aik meme hai, enjoy kar lo"]
-        return base_caps[:2]
-
-    print("\n================ RAW CAPTIONS GENERATED ================")
-    print(text, "\n")
+        return None, []
 
     candidates = []
     for line in text.splitlines():
@@ -422,11 +2016,6 @@ Context: emotion = {emotion}; user_text = \"{user_text}\"
     if len(candidates) < 2:
         candidates = (candidates + ["Smile kar lo zara", "Zindagi aik meme hai"])[:4]
 
-    print("➡️ FILTERED CANDIDATES:", candidates)
-
-    print("\n================ JUDGING & REFLEXION (4 CRITERIA) ================")
-
-    judged = []
     context_prompt = f"Create funny Roman Urdu meme captions for emotion '{emotion}'. Keep them witty, short, and natural-sounding."
     critique_instructions = (
         "Rewrite the caption to be wittier and more natural-sounding Roman Urdu while preserving brevity. "
@@ -434,40 +2023,314 @@ Context: emotion = {emotion}; user_text = \"{user_text}\"
         "Keep it to <=10 words if possible."
     )
 
-    for cand in candidates[:4]:
-        print(f"\n🔸 ORIGINAL CANDIDATE: {cand}")
-        final_text, judge_info = judge_and_reflect_with_explanation(
-            cand, context_prompt, critique_instructions, emotion, score_threshold=7
-        )
-
-        print(f"   ⭐ SCORE: {judge_info['total_score']}")
-        print(f"   🎯 FINAL (AFTER REFLEXION): {final_text}")
+    candidates = candidates[:4]
+    outcomes = judge_caption_candidates(candidates, context_prompt, critique_instructions, emotion)
 
-        judged.append((final_text, judge_info.get("total_score") or 0))
+    scored = [
+        {
+            "original": cand,
+            "final": final_text,
+            "score": judge_info.get("total_score") or 0,
+            "local_score": judge_info.get("local_score") or 0
+        }
+        for cand, (final_text, judge_info) in zip(candidates, outcomes)
+    ]
+    # Unjudged candidates (score 0) fall back to the local pre-score order
+    scored.sort(key=lambda c: (c["score"], c["local_score"]), reverse=True)
+    return text, scored
 
-    judged_sorted = sorted(judged, key=lambda x: x[1], reverse=True)
+def generate_humorous_captions(emotion, user_text, personalize=False):
+    """
+    Generate 2 short, humorous Roman Urdu captions with reflexion based on 4 criteria.
+    Unless personalize is set, they come from the caption bank when it has
+    enough captions for this emotion.
+    """
+    if CAPTION_BANK_ENABLED:
+        if personalize:
+            caption_bank_lookups.inc(outcome="personalized")
+        else:
+            banked = caption_bank.sample(emotion, 2)
+            caption_bank_lookups.inc(outcome="hit" if banked else "low")
+            if banked:
+                return banked
 
-    print("\n================ FINAL SORTED CAPTIONS ================")
-    for cap, score in judged_sorted:
-        print(f"   {score} → {cap}")
+    text, scored = generate_scored_captions(emotion, user_text)
+    if not text:
+        return list(DEFAULT_CAPTIONS)
 
     unique_caps = []
-    for cap, sc in judged_sorted:
-        if cap not in unique_caps:
-            unique_caps.append(cap)
+    for candidate in scored:
+        if candidate["final"] not in unique_caps:
+            unique_caps.append(candidate["final"])
         if len(unique_caps) == 2:
             break
 
-    print("\n================ SELECTED TOP 2 CAPTIONS ================")
-    print(unique_caps, "\n")
+    if judge_log_sampled():
+        judge_logger.debug(json.dumps({
+            "step": "caption_selection",
+            "mode": CAPTION_JUDGE_MODE,
+            "raw": text,
+            "candidates": scored,
+            "selected": unique_caps
+        }, ensure_ascii=False))
 
     if not unique_caps:
-        unique_caps = ["Smile kar lo zara", "Zindagi aik meme hai, enjoy kar lo"]
+        unique_caps = list(DEFAULT_CAPTIONS)
 
     return unique_caps
 
+# ============= CAPTION BANK =============
+
+# Judged captions per GoEmotions label, so most meme requests skip the
+# generate/judge/reflect round trips. Requests only sample from memory;
+# a background thread fills and refreshes the bank.
+CAPTION_BANK_ENABLED = os.getenv("CAPTION_BANK", "1") == "1"
+CAPTION_BANK_DB_PATH = os.getenv("CAPTION_BANK_DB_PATH", "caption_bank.sqlite3")
+# Captions kept per emotion; with fewer than the low-water mark requests use the LLM
+CAPTION_BANK_TARGET = int(os.getenv("CAPTION_BANK_TARGET", "12"))
+CAPTION_BANK_LOW_WATER = int(os.getenv("CAPTION_BANK_LOW_WATER", "4"))
+# Captions older than this are dropped and replaced with fresh ones
+CAPTION_BANK_MAX_AGE_S = float(os.getenv("CAPTION_BANK_MAX_AGE_S", str(3 * 24 * 3600)))
+# Seconds the filler sleeps once every emotion is full; 0 disables the filler
+CAPTION_BANK_REFRESH_INTERVAL_S = float(os.getenv("CAPTION_BANK_REFRESH_INTERVAL_S", "600"))
+# Pause between fill rounds so the filler doesn't crowd out live Gemini traffic
+CAPTION_BANK_FILL_PAUSE_S = float(os.getenv("CAPTION_BANK_FILL_PAUSE_S", "2"))
+
+GO_EMOTIONS_LABELS = (
+    "admiration", "amusement", "anger", "annoyance", "approval", "caring", "confusion",
+    "curiosity", "desire", "disappointment", "disapproval", "disgust", "embarrassment",
+    "excitement", "fear", "gratitude", "grief", "joy", "love", "nervousness", "optimism",
+    "pride", "realization", "relief", "remorse", "sadness", "surprise", "neutral",
+)
+
+class CaptionBank:
+    """
+    Pre-judged captions per emotion, held in memory for constant-time
+    sampling and persisted to SQLite so a restart starts warm. Only
+    captions that passed the judge unchanged are banked, and none are
+    generated from user text.
+    """
+
+    def __init__(self, db_path, emotions, target=12, low_water=4, max_age_s=3 * 24 * 3600):
+        self.db_path = db_path
+        self.emotions = tuple(emotions)
+        self.target = max(1, target)
+        self.low_water = max(2, low_water)
+        self.max_age_s = max_age_s
+        self._entries = {}
+        self._wanted = []
+        self._cooldown = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._filler = None
+        self._stats = {"hits": 0, "low": 0, "fill_rounds": 0, "added": 0, "expired": 0}
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS caption_bank ("
+                "emotion TEXT, caption TEXT, score REAL, created_at REAL, PRIMARY KEY (emotion, caption))"
+            )
+            self._db.commit()
+        return self._db
+
+    def load(self):
+        """Load every caption younger than max_age_s from disk"""
+        cutoff = time.time() - self.max_age_s
+        try:
+            with self._db_lock:
+                rows = self._connection().execute(
+                    "SELECT emotion, caption, score, created_at FROM caption_bank WHERE created_at > ?", (cutoff,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Caption bank read error: {e}")
+            rows = []
+        entries = {}
+        for emotion, caption, score, created_at in rows:
+            entries.setdefault(emotion, []).append((caption, score, created_at))
+        with self._lock:
+            self._entries = entries
+            self._loaded = True
+        print(f"🗃️ Caption bank loaded {len(rows)} captions across {len(entries)} emotions")
+
+    def _persist(self, emotion, entries):
+        try:
+            with self._db_lock:
+                db = self._connection()
+                db.execute("DELETE FROM caption_bank WHERE emotion = ?", (emotion,))
+                db.executemany(
+                    "INSERT INTO caption_bank (emotion, caption, score, created_at) VALUES (?, ?, ?, ?)",
+                    [(emotion, caption, score, created_at) for caption, score, created_at in entries]
+                )
+                db.commit()
+        except sqlite3.Error as e:
+            print(f"Caption bank write error: {e}")
+
+    def sample(self, emotion, k=2):
+        """
+        k distinct banked captions for an emotion, or None when the bank has
+        fewer than low_water of them (the emotion is then filled first).
+        """
+        if not self._loaded:
+            self.load()
+        emotion = emotion.lower()
+        with self._lock:
+            entries = self._entries.get(emotion)
+            if entries and len(entries) >= max(k, self.low_water):
+                self._stats["hits"] += 1
+                return [caption for caption, _, _ in random.sample(entries, k)]
+            self._stats["low"] += 1
+            if emotion not in self._wanted:
+                self._wanted.append(emotion)
+        self._wake.set()
+        return None
+
+    def add(self, emotion, captions):
+        """Bank (caption, score) pairs, keeping the newest `target` per emotion"""
+        emotion = emotion.lower()
+        now = time.time()
+        with self._lock:
+            entries = self._entries.setdefault(emotion, [])
+            known = {caption for caption, _, _ in entries}
+            added = [(caption, score, now) for caption, score in captions if caption not in known]
+            known.update(caption for caption, _, _ in added)
+            entries.extend(added)
+            entries.sort(key=lambda entry: entry[2])
+            del entries[:max(0, len(entries) - self.target)]
+            self._stats["added"] += len(added)
+            snapshot = list(entries)
+        if added:
+            self._persist(emotion, snapshot)
+        return len(added)
+
+    def expire(self):
+        """Drop captions older than max_age_s so the filler replaces them"""
+        cutoff = time.time() - self.max_age_s
+        expired = 0
+        with self._lock:
+            for emotion, entries in self._entries.items():
+                fresh = [entry for entry in entries if entry[2] > cutoff]
+                expired += len(entries) - len(fresh)
+                entries[:] = fresh
+            self._stats["expired"] += expired
+        if expired:
+            try:
+                with self._db_lock:
+                    db = self._connection()
+                    db.execute("DELETE FROM caption_bank WHERE created_at <= ?", (cutoff,))
+                    db.commit()
+            except sqlite3.Error as e:
+                print(f"Caption bank write error: {e}")
+        return expired
+
+    def next_emotion(self):
+        """
+        Emotion to fill next: ones requests found low first, then the emptiest
+        below target. Emotions whose last round added nothing sit out a cooldown.
+        """
+        now = time.monotonic()
+        with self._lock:
+            ready = lambda emotion: self._cooldown.get(emotion, 0) <= now
+            for emotion in self._wanted:
+                if ready(emotion):
+                    self._wanted.remove(emotion)
+                    return emotion
+            counts = [
+                (len(self._entries.get(emotion, ())), emotion)
+                for emotion in self.emotions if ready(emotion)
+            ]
+        count, emotion = min(counts) if counts else (self.target, None)
+        return emotion if count < self.target else None
+
+    def fill_once(self, emotion, cooldown_s=0):
+        """One generate + judge round for an emotion; banks the captions that passed as written"""
+        with self._lock:
+            self._stats["fill_rounds"] += 1
+        _, scored = generate_scored_captions(emotion, "")
+        passed = [
+            (candidate["final"], candidate["score"])
+            for candidate in scored
+            if candidate["final"] == candidate["original"] and candidate["score"] >= CAPTION_SCORE_THRESHOLD
+        ]
+        added = self.add(emotion, passed)
+        if not added and cooldown_s > 0:
+            with self._lock:
+                self._cooldown[emotion] = time.monotonic() + cooldown_s
+        return added
+
+    def start(self, interval):
+        """Fill and refresh the bank in the background; sleeps `interval` seconds when it is full"""
+        if interval <= 0 or self._filler is not None:
+            return
+        if not self._loaded:
+            self.load()
+
+        def fill():
+            while True:
+                try:
+                    self.expire()
+                    breaker = gemini_client.breaker
+                    if gemini_model is None or not breaker.available():
+                        # The fill round's own Gemini call is what moves an
+                        # open breaker to half-open, so retry after its cooldown
+                        self._wake.wait(min(interval, breaker.cooldown_s))
+                        self._wake.clear()
+                        continue
+                    emotion = self.next_emotion()
+                    if emotion is None:
+                        self._wake.wait(interval)
+                        self._wake.clear()
+                        continue
+                    self.fill_once(emotion, cooldown_s=interval)
+                except Exception as e:
+                    print(f"Caption bank fill error: {e}")
+                time.sleep(CAPTION_BANK_FILL_PAUSE_S)
+
+        self._filler = threading.Thread(target=fill, name="caption-bank", daemon=True)
+        self._filler.start()
+
+    def size(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["captions"] = {emotion: len(self._entries.get(emotion, ())) for emotion in self.emotions}
+            stats["wanted"] = list(self._wanted)
+        stats["total"] = sum(stats["captions"].values())
+        stats["target_per_emotion"] = self.target
+        stats["low_water"] = self.low_water
+        return stats
+
+caption_bank = CaptionBank(
+    CAPTION_BANK_DB_PATH, GO_EMOTIONS_LABELS, CAPTION_BANK_TARGET, CAPTION_BANK_LOW_WATER, CAPTION_BANK_MAX_AGE_S
+)
+
+def personalize_requested(data=None):
+    """personalize flag from a JSON body, or from the form of an audio upload"""
+    value = (data or {}).get('personalize', request.form.get('personalize', False))
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
 # ============= RECOMMENDATIONS WITH REFLEXION =============
 
+def fallback_recommendations(emotion):
+    """Static support message used when Gemini is unavailable"""
+    return (
+        f"I can sense you're feeling {emotion} 🌿\n"
+        "🌞 Take slow deep breaths\n"
+        "💧 Drink some water\n"
+        "🕊️ Step outside for a few minutes\n"
+        "💫 Write down what's on your mind\n\n"
+        "If this is serious, please consider professional help 💚"
+    )
+
 def generate_recommendations(emotion, confidence, text):
     """Generate mental health recommendations with reflexion"""
     base_prompt = f"""
@@ -486,16 +2349,9 @@ Write a short, empathetic, and visually appealing response with ONLY the followi
 DO NOT include any movies, series, books, or music recommendations in this section.
 Keep language simple and comforting.
 """
-    response_text = safe_gemini_generate(base_prompt)
+    response_text = safe_gemini_generate(base_prompt, call_site="recommendations")
     if not response_text:
-        return (
-            f"I can sense you're feeling {emotion} 🌿\n"
-            "🌞 Take slow deep breaths\n"
-            "💧 Drink some water\n"
-            "🕊️ Step outside for a few minutes\n"
-            "💫 Write down what's on your mind\n\n"
-            "If this is serious, please consider professional help 💚"
-        )
+        return fallback_recommendations(emotion)
 
     context_prompt = (
         f"Produce a short empathetic support message with: acknowledgment, "
@@ -508,12 +2364,29 @@ Keep language simple and comforting.
         "Fix formatting and make it visually soothing; do not add long explanations."
     )
 
-    final_text, judge_info = judge_and_reflect_with_explanation(response_text, context_prompt, critique_instructions, emotion, score_threshold=7)
+    final_text, judge_info = judge_and_reflect_with_explanation(
+        response_text, context_prompt, critique_instructions, emotion, score_threshold=7,
+        judge_call_site="recommendation_judge", reflect_call_site="recommendation_reflect"
+    )
 
     return final_text
 
 # ============= ENTERTAINMENT RECOMMENDATIONS WITH LINKS =============
 
+FALLBACK_ENTERTAINMENT_TEXT = """
+Movies/Series:
+Taare Zameen Par
+Piku
+
+Music:
+Soulmate - Badshah
+Tum Aa Gaye Ho - Rahat Fateh Ali Khan
+
+Books:
+The Alchemist - Paulo Coelho
+Midnight's Children - Salman Rushdie
+"""
+
 def generate_entertainment_recommendations(emotion, confidence, text):
     """Generate entertainment recommendations WITH clickable links"""
     base_prompt = f"""
@@ -539,22 +2412,14 @@ Books:
 
 Do not add any other text, explanations, or numbering. Only provide names in the exact format shown.
 """
-    response_text = safe_gemini_generate(base_prompt)
+    response_text = safe_gemini_generate(base_prompt, call_site="entertainment")
     if not response_text:
-        response_text = """
-Movies/Series:
-Taare Zameen Par
-Piku
-
-Music:
-Soulmate - Badshah
-Tum Aa Gaye Ho - Rahat Fateh Ali Khan
+        response_text = FALLBACK_ENTERTAINMENT_TEXT
 
-Books:
-The Alchemist - Paulo Coelho
-Midnight's Children - Salman Rushdie
-"""
+    return parse_entertainment_response(response_text)
 
+def parse_entertainment_response(response_text):
+    """Parse the Movies/Series, Music and Books sections into link dicts"""
     result = {
         'movies': [],
         'music': [],
@@ -599,70 +2464,988 @@ Midnight's Children - Salman Rushdie
 
     return result
 
+# ============= MEME TEMPLATE INDEX =============
+
+TEMPLATE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Templates wider than this are downscaled once when decoded
+TEMPLATE_MAX_WIDTH = int(os.getenv("TEMPLATE_MAX_WIDTH", "800"))
+TEMPLATE_CACHE_MB = float(os.getenv("TEMPLATE_CACHE_MB", "128"))
+# Seconds between template folder rescans; 0 disables watching
+TEMPLATE_WATCH_INTERVAL_S = float(os.getenv("TEMPLATE_WATCH_INTERVAL_S", "0"))
+
+class MemeTemplateIndex:
+    """
+    Startup index of meme templates per emotion folder, plus an LRU cache of
+    decoded, size-normalized RGBA images bounded by a memory budget.
+    """
+
+    def __init__(self, root, max_width=800, memory_budget_bytes=128 * 1024 * 1024):
+        self.root = root
+        self.max_width = max_width
+        self.memory_budget_bytes = memory_budget_bytes
+        self._templates = None
+        self._signature = None
+        self._decoded = OrderedDict()
+        self._decoded_bytes = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "refreshes": 0}
+
+    def _scan(self):
+        templates = {}
+        signature = []
+        if os.path.isdir(self.root):
+            for emotion in sorted(os.listdir(self.root)):
+                folder = os.path.join(self.root, emotion)
+                if not os.path.isdir(folder):
+                    continue
+                files = sorted(f for f in os.listdir(folder) if f.lower().endswith(TEMPLATE_EXTENSIONS))
+                templates[emotion.lower()] = [os.path.join(folder, f) for f in files]
+                signature.append((emotion, os.path.getmtime(folder), tuple(files)))
+        return templates, tuple(signature)
+
+    def refresh(self):
+        """Rescan the template folders. Returns True if anything changed."""
+        templates, signature = self._scan()
+        with self._lock:
+            if signature == self._signature:
+                return False
+            self._templates = templates
+            self._signature = signature
+            self._stats["refreshes"] += 1
+            live_paths = {path for paths in templates.values() for path in paths}
+            for path in [p for p in self._decoded if p not in live_paths]:
+                self._decoded_bytes -= self._image_bytes(self._decoded.pop(path))
+        total = sum(len(paths) for paths in templates.values())
+        print(f"🖼️ Indexed {total} meme templates across {len(templates)} emotions")
+        return True
+
+    def templates(self, emotion):
+        """Template paths for an emotion, or None if it has no folder"""
+        if self._templates is None:
+            self.refresh()
+        return self._templates.get(emotion.lower())
+
+    def choose(self, emotion):
+        paths = self.templates(emotion)
+        return random.choice(paths) if paths else None
+
+    @staticmethod
+    def _image_bytes(image):
+        return image.width * image.height * 4
+
+    def _decode(self, path):
+        image = Image.open(path).convert("RGBA")
+        if self.max_width and image.width > self.max_width:
+            height = max(1, round(image.height * self.max_width / image.width))
+            image = image.resize((self.max_width, height), Image.LANCZOS)
+        return image
+
+    def load(self, path):
+        """
+        Decoded RGBA image for a template path. The returned image is shared,
+        so callers must not draw on it in place.
+        """
+        with self._lock:
+            image = self._decoded.get(path)
+            if image is not None:
+                self._decoded.move_to_end(path)
+                self._stats["hits"] += 1
+                return image
+            self._stats["misses"] += 1
+
+        image = self._decode(path)
+        size = self._image_bytes(image)
+        if size > self.memory_budget_bytes:
+            return image
+
+        with self._lock:
+            if path not in self._decoded:
+                self._decoded[path] = image
+                self._decoded_bytes += size
+            while self._decoded_bytes > self.memory_budget_bytes:
+                _, evicted = self._decoded.popitem(last=False)
+                self._decoded_bytes -= self._image_bytes(evicted)
+                self._stats["evictions"] += 1
+        return image
+
+    def start_watching(self, interval):
+        """Poll the template folders every `interval` seconds in the background"""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Template refresh error: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="template-watcher", daemon=True)
+        self._watcher.start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["decoded_templates"] = len(self._decoded)
+            stats["decoded_mb"] = round(self._decoded_bytes / (1024 * 1024), 2)
+        stats["budget_mb"] = round(self.memory_budget_bytes / (1024 * 1024), 2)
+        stats["templates"] = {emotion: len(paths) for emotion, paths in (self._templates or {}).items()}
+        return stats
+
+template_index = MemeTemplateIndex(MEMES_FOLDER, TEMPLATE_MAX_WIDTH, int(TEMPLATE_CACHE_MB * 1024 * 1024))
+
+# ============= CAPTION LAYOUT =============
+
+CAPTION_FONT_FACE = os.getenv("CAPTION_FONT_FACE", "arial.ttf")
+
+@functools.lru_cache(maxsize=64)
+def load_caption_font(face, size):
+    """Load a caption font once per (face, size)"""
+    try:
+        return ImageFont.truetype(face, size)
+    except Exception:
+        return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=16384)
+def measure_word(face, size, word):
+    """Rendered width of a single word (or space) in a cached font"""
+    return load_caption_font(face, size).getlength(word)
+
+@functools.lru_cache(maxsize=2048)
+def layout_caption(caption, max_width, font_size, face=CAPTION_FONT_FACE):
+    """
+    Greedy word wrap in linear time using cached word widths.
+    Uses the same fit rule as the original loop (the line plus a trailing
+    space must fit), so a single over-long word still gets its own line.
+
+    Returns: tuple of (line_text, line_width)
+    """
+    space = measure_word(face, font_size, " ")
+    lines = []
+    words, line_width = [], 0.0
+    for word in caption.split():
+        word_width = measure_word(face, font_size, word) + space
+        if words and line_width + word_width > max_width:
+            lines.append((" ".join(words), line_width - space))
+            words, line_width = [], 0.0
+        words.append(word)
+        line_width += word_width
+    if words:
+        lines.append((" ".join(words), line_width - space))
+    return tuple(lines)
+
+# ============= CONTENT-ADDRESSED MEME STORE =============
+
+# Bump whenever render_meme() output changes so old files are not reused
+MEME_RENDER_VERSION = "1"
+MEME_JPEG_QUALITY = 90
+MEME_PUBLIC_URL = os.getenv("MEME_PUBLIC_URL", "http://localhost:5000/memes")
+MEME_STORE_MAX_MB = float(os.getenv("MEME_STORE_MAX_MB", "512"))
+MEME_MAX_AGE_S = float(os.getenv("MEME_MAX_AGE_S", str(7 * 24 * 3600)))
+MEME_GC_INTERVAL_S = float(os.getenv("MEME_GC_INTERVAL_S", "600"))
+MEME_HTTP_MAX_AGE_S = 365 * 24 * 3600
+# Serving a meme refreshes its mtime (its "last used" time) at most this often
+MEME_TOUCH_INTERVAL_S = float(os.getenv("MEME_TOUCH_INTERVAL_S", "3600"))
+# Temp files from interrupted writes older than this are swept by the GC
+MEME_TMP_MAX_AGE_S = float(os.getenv("MEME_TMP_MAX_AGE_S", "600"))
+
+# meme_<content hash>[_<variant>].<ext>; older uuid-named files do not match
+# and are never garbage collected
+CONTENT_MEME_RE = re.compile(r'^meme_([0-9a-f]{32})(?:_([a-z0-9]+))?\.(jpg|webp)$')
+MEME_TMP_RE = re.compile(r'^meme_[0-9a-f]{32}(?:_[a-z0-9]+)?\.(jpg|webp)\.[0-9a-f]{8}\.tmp$')
+
+def meme_content_key(template_path, caption):
+    """Hash of everything that determines a rendered meme's bytes"""
+    stat = os.stat(template_path)
+    template_id = os.path.relpath(template_path, MEMES_FOLDER).replace(os.sep, "/")
+    parts = [
+        MEME_RENDER_VERSION, template_id, str(stat.st_size), str(stat.st_mtime_ns),
+        caption, CAPTION_FONT_FACE, str(TEMPLATE_MAX_WIDTH), str(MEME_JPEG_QUALITY),
+    ]
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()[:32]
+
+def meme_filename(key, variant=None, ext="jpg"):
+    suffix = f"_{variant}" if variant else ""
+    return f"meme_{key}{suffix}.{ext}"
+
+def store_meme_bytes(filename, data):
+    """Write atomically so concurrent readers never see a partial file"""
+    output_path = os.path.join(MEMES_OUTPUT_FOLDER, filename)
+    tmp_path = f"{output_path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def touch_meme(filename):
+    """Mark a stored meme as used; mtime is what gc_meme_store() ages files by"""
+    path = os.path.join(MEMES_OUTPUT_FOLDER, filename)
+    try:
+        if time.time() - os.stat(path).st_mtime > MEME_TOUCH_INTERVAL_S:
+            os.utime(path)
+    except OSError:
+        pass
+
+def gc_meme_store(max_bytes=None, max_age_s=None):
+    """
+    Delete content-addressed memes unused (not created, reused or served)
+    for longer than max_age_s, then the least recently used ones until the
+    store fits in max_bytes. Stale temp files from interrupted writes are
+    removed too.
+    Returns: (deleted_files, remaining_bytes)
+    """
+    max_bytes = MEME_STORE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    max_age_s = MEME_MAX_AGE_S if max_age_s is None else max_age_s
+    now = time.time()
+
+    deleted = 0
+    entries = []
+    for name in os.listdir(MEMES_OUTPUT_FOLDER):
+        is_tmp = MEME_TMP_RE.match(name)
+        if not is_tmp and not CONTENT_MEME_RE.match(name):
+            continue
+        path = os.path.join(MEMES_OUTPUT_FOLDER, name)
+        try:
+            stat = os.stat(path)
+            if is_tmp:
+                if now - stat.st_mtime > MEME_TMP_MAX_AGE_S:
+                    os.remove(path)
+                    deleted += 1
+                continue
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if now - mtime <= max_age_s and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            deleted += 1
+            total -= size
+        except FileNotFoundError:
+            pass
+    return deleted, total
+
+def start_meme_gc(interval):
+    if interval <= 0:
+        return
+
+    def collect():
+        while True:
+            try:
+                deleted, remaining = gc_meme_store()
+                if deleted:
+                    print(f"🧹 Meme GC removed {deleted} files, {remaining / (1024 * 1024):.1f} MB left")
+            except Exception as e:
+                print(f"Meme GC error: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=collect, name="meme-gc", daemon=True).start()
+
+# ============= DEFERRED MEME RENDERING =============
+
+# "eager" renders before the API responds; "deferred" returns a signed URL
+# and renders on the first GET of that URL
+MEME_RENDER_MODE = os.getenv("MEME_RENDER_MODE", "eager").lower()
+# Must be shared by every worker and stable across restarts for deferred
+# URLs to stay valid; a random per-process key is only fine for local dev.
+MEME_SIGNING_KEY = os.getenv("MEME_SIGNING_KEY", "").encode("utf-8") or os.urandom(32)
+
+_render_locks = {}
+_render_locks_guard = threading.Lock()
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def sign_meme_token(template_path, caption):
+    """Signed token carrying the template id and caption of a deferred meme"""
+    template_id = os.path.relpath(template_path, MEMES_FOLDER).replace(os.sep, "/")
+    payload = _b64encode(json.dumps({"t": template_id, "c": caption}, ensure_ascii=False).encode("utf-8"))
+    signature = hmac.new(MEME_SIGNING_KEY, payload.encode("ascii"), hashlib.sha256).digest()
+    return f"{payload}.{_b64encode(signature[:16])}"
+
+def verify_meme_token(token):
+    """Returns (template_path, caption) for a valid token, else None"""
+    try:
+        payload, signature = token.split(".", 1)
+        expected = hmac.new(MEME_SIGNING_KEY, payload.encode("ascii"), hashlib.sha256).digest()[:16]
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        data = json.loads(_b64decode(payload).decode("utf-8"))
+        template_path = os.path.normpath(os.path.join(MEMES_FOLDER, data["t"]))
+        root = os.path.normpath(MEMES_FOLDER)
+        if not template_path.startswith(root + os.sep) or not os.path.isfile(template_path):
+            return None
+        return template_path, data["c"]
+    except Exception:
+        return None
+
+def store_once(filename, produce_bytes):
+    """
+    Store produce_bytes() under filename unless the file already exists.
+    Concurrent callers for the same file share one producer call (single-flight).
+    """
+    output_path = os.path.join(MEMES_OUTPUT_FOLDER, filename)
+    with _render_locks_guard:
+        entry = _render_locks.setdefault(filename, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            if os.path.exists(output_path):
+                return output_path
+            return store_meme_bytes(filename, produce_bytes())
+    finally:
+        with _render_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                _render_locks.pop(filename, None)
+
+def ensure_meme_rendered(template_path, caption, filename):
+    """Render and store a meme unless it already exists"""
+    def produce():
+        buffer = io.BytesIO()
+        render_meme(template_path, caption).save(buffer, format="JPEG", quality=MEME_JPEG_QUALITY)
+        return buffer.getvalue()
+    return store_once(filename, produce)
+
+def render_deferred_meme(filename, key, token):
+    """Render a deferred meme from its signed token. Returns False if the token is invalid."""
+    verified = verify_meme_token(token)
+    if verified is None:
+        return False
+    template_path, caption = verified
+    # The token must describe exactly the meme this filename addresses
+    if meme_content_key(template_path, caption) != key:
+        return False
+    ensure_meme_rendered(template_path, caption, filename)
+    return True
+
+# ============= MEME FORMAT & SIZE VARIANTS =============
+
+MEME_VARIANT_WIDTHS = tuple(sorted(int(w) for w in os.getenv("MEME_VARIANT_WIDTHS", "320,480,720").split(",") if w.strip()))
+MEME_WEBP_QUALITY = int(os.getenv("MEME_WEBP_QUALITY", "80"))
+MEME_VARIANT_JPEG_QUALITY = int(os.getenv("MEME_VARIANT_JPEG_QUALITY", "85"))
+WEBP_SUPPORTED = features.check("webp")
+
+def client_accepts_webp():
+    """Only an explicit image/webp counts; */* does not guarantee WebP support"""
+    return WEBP_SUPPORTED and any(
+        mimetype == "image/webp" and quality > 0 for mimetype, quality in request.accept_mimetypes
+    )
+
+def pick_variant_width(requested):
+    """Snap a requested width up to the nearest configured variant, or None for full size"""
+    for width in MEME_VARIANT_WIDTHS:
+        if requested <= width:
+            return width
+    return None
+
+def ensure_meme_variant(key, width, ext):
+    """
+    Encode (once) a resized and/or WebP copy of the stored master JPEG.
+    Widths at or above the master's own width are not upscaled.
+    Returns: (filename, variant), with variant None for the master itself
+    """
+    master_path = os.path.join(MEMES_OUTPUT_FOLDER, meme_filename(key))
+    if width:
+        with Image.open(master_path) as master:
+            if width >= master.width:
+                width = None
+    if not width and ext == "jpg":
+        return meme_filename(key), None
+
+    variant = f"w{width}" if width else "full"
+    filename = meme_filename(key, variant, ext)
+
+    def produce():
+        image = Image.open(master_path).convert("RGB")
+        if width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if ext == "webp":
+            image.save(buffer, format="WEBP", quality=MEME_WEBP_QUALITY, method=4)
+        else:
+            image.save(buffer, format="JPEG", quality=MEME_VARIANT_JPEG_QUALITY, optimize=True)
+        return buffer.getvalue()
+
+    store_once(filename, produce)
+    return filename, variant
+
 # ============= MEME IMAGE CREATION =============
 
+def render_meme(template_path, caption):
+    """Draw the caption onto a template and return the RGB image"""
+    image = template_index.load(template_path)
+
+    txt_layer = Image.new("RGBA", image.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(txt_layer)
+    font_size = max(20, image.width // 25)
+    font = load_caption_font(CAPTION_FONT_FACE, font_size)
+
+    max_width = image.width - 40
+    lines = layout_caption(caption, max_width, font_size)
+
+    y_text = image.height - (len(lines) * (font_size + 5)) - 20
+    for line, w in lines:
+        x = (image.width - w) / 2
+        draw.text((x, y_text), line, font=font, fill=(255, 255, 255, 255),
+                 stroke_width=2, stroke_fill="black")
+        y_text += font_size + 5
+
+    return Image.alpha_composite(image, txt_layer).convert("RGB")
+
+@instrumented("meme_image")
 def create_meme_image(emotion, caption):
     """Create a meme with caption overlay and save it as a public image"""
     try:
-        emotion_folder = os.path.join(MEMES_FOLDER, emotion.lower())
-        print("🎭 Emotion:", emotion)
-        print("📁 Checking folder:", emotion_folder)
-
-        if not os.path.exists(emotion_folder):
-            print("❌ Folder not found!")
+        image_files = template_index.templates(emotion)
+        if image_files is None:
+            print(f"❌ Template folder not found for {emotion}!")
             return None
-        
-        image_files = [f for f in os.listdir(emotion_folder)
-                       if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
         if not image_files:
-            print("⚠️ No image files in folder!")
+            print(f"⚠️ No template images for {emotion}!")
             return None
         
-        img_path = os.path.join(emotion_folder, random.choice(image_files))
-        image = Image.open(img_path).convert("RGBA")
-
-        txt_layer = Image.new("RGBA", image.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(txt_layer)
-        font_size = max(20, image.width // 25)
-        try:
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except Exception:
-            font = ImageFont.load_default()
-
-        max_width = image.width - 40
-        lines, line = [], ""
-        for word in caption.split():
-            test_line = line + word + " "
-            if draw.textlength(test_line, font=font) <= max_width:
-                line = test_line
-            else:
-                if line:
-                    lines.append(line.strip())
-                line = word + " "
-        if line:
-            lines.append(line.strip())
+        img_path = random.choice(image_files)
+        filename = meme_filename(meme_content_key(img_path, caption))
+        output_path = os.path.join(MEMES_OUTPUT_FOLDER, filename)
 
-        y_text = image.height - (len(lines) * (font_size + 5)) - 20
-        for line in lines:
-            w = draw.textlength(line, font=font)
-            x = (image.width - w) / 2
-            draw.text((x, y_text), line, font=font, fill=(255, 255, 255, 255),
-                     stroke_width=2, stroke_fill="black")
-            y_text += font_size + 5
+        if os.path.exists(output_path):
+            # Same template + caption + render params: reuse the stored file
+            os.utime(output_path)
+            log_meme("reused", emotion=emotion, filename=filename)
+            return f"{MEME_PUBLIC_URL}/{filename}"
 
-        combined = Image.alpha_composite(image, txt_layer)
+        if MEME_RENDER_MODE == "deferred":
+            # serve_meme() renders it on the first GET
+            return f"{MEME_PUBLIC_URL}/{filename}?t={sign_meme_token(img_path, caption)}"
 
-        random_name = f"meme_{uuid.uuid4().hex[:8]}.jpg"
-        output_path = os.path.join(MEMES_OUTPUT_FOLDER, random_name)
-        combined.convert("RGB").save(output_path, format="JPEG", quality=90)
-        print("✅ Meme created successfully!")
+        ensure_meme_rendered(img_path, caption, filename)
+        log_meme("created", emotion=emotion, filename=filename)
 
-        return f"http://localhost:5000/memes/{random_name}"
+        return f"{MEME_PUBLIC_URL}/{filename}"
 
     except Exception as e:
         print("💥 Error in create_meme_image:", e)
         return None
 
+def render_memes(emotion, captions, on_meme=None):
+    """Render one meme per caption, skipping any that fail"""
+    memes = []
+    for caption in captions:
+        meme_img = create_meme_image(emotion, caption)
+        if meme_img:
+            meme = {
+                'caption': caption,
+                'image': meme_img
+            }
+            memes.append(meme)
+            if on_meme:
+                on_meme(meme)
+    return memes
+
+# ============= STAGE PIPELINE EXECUTOR =============
+
+STAGE_MAX_WORKERS = int(os.getenv("STAGE_MAX_WORKERS", "16"))
+# Stage timeouts count from when a stage starts running; this bounds how long
+# a stage may wait for a free worker before it falls back
+STAGE_QUEUE_TIMEOUT_S = float(os.getenv("STAGE_QUEUE_TIMEOUT_S", "60"))
+STAGE_TIMEOUTS_S = {
+    "recommendations": float(os.getenv("RECOMMENDATIONS_STAGE_TIMEOUT_S", "30")),
+    "entertainment": float(os.getenv("ENTERTAINMENT_STAGE_TIMEOUT_S", "20")),
+    "captions": float(os.getenv("CAPTIONS_STAGE_TIMEOUT_S", "45")),
+    "memes": float(os.getenv("MEMES_STAGE_TIMEOUT_S", "15")),
+}
+
+stage_executor = ThreadPoolExecutor(max_workers=STAGE_MAX_WORKERS, thread_name_prefix="analysis-stage")
+
+def run_stage_graph(stages, on_stage_done=None):
+    """
+    Run a small DAG of stages, starting each stage as soon as all of its
+    dependencies have finished.
+
+    stages: {name: {"fn": fn(results), "deps": [names], "timeout": seconds, "fallback": fn(results)}}
+    Each fn receives a snapshot of the results finished so far. A stage that
+    raises, runs past its timeout (counted from when it starts running) or
+    waits longer than STAGE_QUEUE_TIMEOUT_S for a worker is replaced by its
+    fallback value, and its dependents run on that value instead.
+    on_stage_done(name, value) is called as each stage finishes.
+
+    Returns: (results, incomplete_stages)
+    """
+    results = {}
+    incomplete = []
+    pending = dict(stages)
+    running = {}
+    started_at = {}
+
+    def run(name, fn, snapshot):
+        started_at[name] = time.monotonic()
+        return fn(snapshot)
+
+    def deadline_of(name, submitted_at):
+        if name in started_at:
+            return started_at[name] + stages[name].get("timeout", 30)
+        return submitted_at + STAGE_QUEUE_TIMEOUT_S
+
+    def finish(name, value):
+        results[name] = value
+        if on_stage_done:
+            on_stage_done(name, value)
+
+    def fall_back(name, reason):
+        print(f"⚠️ Stage '{name}' {reason}, using fallback")
+        incomplete.append(name)
+        fallback = stages[name].get("fallback")
+        finish(name, fallback(dict(results)) if fallback else None)
+
+    while pending or running:
+        for name, stage in list(pending.items()):
+            if all(dep in results for dep in stage.get("deps", ())):
+                del pending[name]
+                running[stage_executor.submit(run, name, stage["fn"], dict(results))] = (name, time.monotonic())
+
+        if not running:
+            # Remaining stages depend on names that are not in the graph
+            for name in list(pending):
+                del pending[name]
+                fall_back(name, "has unmet dependencies")
+            continue
+
+        next_deadline = min(deadline_of(name, submitted_at) for name, submitted_at in running.values())
+        timeout = max(0, next_deadline - time.monotonic())
+        if any(name not in started_at for name, _ in running.values()):
+            # A queued stage's clock starts when it does, so check back soon
+            timeout = min(timeout, 0.25)
+        done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            name, _ = running.pop(future)
+            if future.exception() is not None:
+                fall_back(name, f"failed: {future.exception()}")
+            else:
+                finish(name, future.result())
+
+        now = time.monotonic()
+        for future, (name, submitted_at) in list(running.items()):
+            if deadline_of(name, submitted_at) <= now:
+                running.pop(future)
+                if future.cancel():
+                    fall_back(name, f"waited over {STAGE_QUEUE_TIMEOUT_S:g}s for a worker")
+                else:
+                    fall_back(name, f"timed out after {stages[name].get('timeout', 30):g}s")
+
+    return results, incomplete
+
+def build_full_analysis(emotion_result, english_text, on_stage_done=None, on_meme=None, personalize=False):
+    """
+    Run recommendations, entertainment and captions concurrently (they only
+    depend on the emotion result), then render memes once captions are ready.
+    on_meme(meme) is called as each meme is rendered; personalize skips the
+    caption bank.
+
+    Returns: (results, incomplete_stages)
+    """
+    emotion = emotion_result['emotion']
+    confidence = emotion_result['confidence']
+
+    stages = {
+        "recommendations": {
+            "fn": lambda r: generate_recommendations(emotion, confidence, english_text),
+            "timeout": STAGE_TIMEOUTS_S["recommendations"],
+            "fallback": lambda r: fallback_recommendations(emotion),
+        },
+        "entertainment": {
+            "fn": lambda r: generate_entertainment_recommendations(emotion, confidence, english_text),
+            "timeout": STAGE_TIMEOUTS_S["entertainment"],
+            "fallback": lambda r: parse_entertainment_response(FALLBACK_ENTERTAINMENT_TEXT),
+        },
+        "captions": {
+            "fn": lambda r: generate_humorous_captions(emotion, english_text, personalize),
+            "timeout": STAGE_TIMEOUTS_S["captions"],
+            "fallback": lambda r: list(DEFAULT_CAPTIONS),
+        },
+        "memes": {
+            "fn": lambda r: render_memes(emotion, r["captions"], on_meme=on_meme),
+            "deps": ["captions"],
+            "timeout": STAGE_TIMEOUTS_S["memes"],
+            "fallback": lambda r: [],
+        },
+    }
+    return run_stage_graph(stages, on_stage_done=on_stage_done)
+
+# ============= AUDIO TRANSCRIPTION =============
+
+WHISPER_SAMPLE_RATE = 16000
+
+@instrumented("audio_decode")
+def decode_audio_bytes(data, sample_rate=WHISPER_SAMPLE_RATE):
+    """
+    Decode uploaded audio bytes to a 16 kHz mono float32 array by piping them
+    through ffmpeg, without touching the disk.
+    """
+    def run(source, stdin=None):
+        out, _ = (
+            ffmpeg.input(source, threads=0)
+            .output("pipe:1", format="s16le", acodec="pcm_s16le", ac=1, ar=sample_rate)
+            .run(input=stdin, capture_stdout=True, capture_stderr=True)
+        )
+        return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+    try:
+        return run("pipe:0", stdin=data)
+    except ffmpeg.Error as e:
+        pipe_error = (e.stderr.decode(errors="ignore").strip().splitlines() or [""])[-1] if e.stderr else e
+
+    # Some containers (e.g. m4a with the index at the end) need a seekable
+    # input, so only those fall back to a private temp file.
+    print(f"⚠️ Pipe decode failed ({pipe_error}), retrying from a temp file")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, "upload")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        try:
+            return run(tmp_path)
+        except ffmpeg.Error as e:
+            raise RuntimeError(f"Could not decode audio: {e.stderr.decode(errors='ignore') if e.stderr else e}") from e
+
+# ============= VOICE ACTIVITY DETECTION & CHUNKING =============
+
+VAD_FRAME_MS = 30
+# Frames louder than max(VAD_MIN_RMS, noise floor * VAD_NOISE_MULTIPLIER) count as speech,
+# but the threshold never exceeds VAD_MAX_THRESHOLD_RATIO of the loudest frame
+VAD_MIN_RMS = float(os.getenv("VAD_MIN_RMS", "0.005"))
+VAD_NOISE_MULTIPLIER = float(os.getenv("VAD_NOISE_MULTIPLIER", "3.0"))
+VAD_MAX_THRESHOLD_RATIO = float(os.getenv("VAD_MAX_THRESHOLD_RATIO", "0.5"))
+# Pauses shorter than this stay inside a segment
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "500"))
+VAD_SPEECH_PAD_MS = int(os.getenv("VAD_SPEECH_PAD_MS", "200"))
+# Whisper decodes 30 s windows, so longer speech is split into chunks this long
+WHISPER_CHUNK_MAX_S = float(os.getenv("WHISPER_CHUNK_MAX_S", "30"))
+
+# ============= WHISPER WORKER POOL =============
+
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "base")
+# Worker processes, each holding its own model; 0 runs Whisper in the API process
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "2"))
+# Transcription jobs allowed in flight at once; further requests wait in line
+WHISPER_MAX_CONCURRENT_JOBS = int(os.getenv("WHISPER_MAX_CONCURRENT_JOBS", "4"))
+WHISPER_QUEUE_TIMEOUT_S = float(os.getenv("WHISPER_QUEUE_TIMEOUT_S", "30"))
+WHISPER_JOB_TIMEOUT_S = float(os.getenv("WHISPER_JOB_TIMEOUT_S", "120"))
+
+class WhisperBusyError(RuntimeError):
+    """Raised when a transcription job cannot get a slot in time"""
+
+class NoSpeechError(ValueError):
+    """Raised when a recording contains no detectable speech"""
+
+whisper_pool = None
+_whisper_pool_lock = threading.Lock()
+whisper_job_slots = threading.BoundedSemaphore(max(1, WHISPER_MAX_CONCURRENT_JOBS))
+
+def detect_speech_segments(audio, sample_rate=WHISPER_SAMPLE_RATE):
+    """
+    Energy-based voice activity detection.
+    Returns a list of (start_sample, end_sample) speech segments with
+    leading, trailing and long inner silences removed.
+    """
+    frame = int(sample_rate * VAD_FRAME_MS / 1000)
+    frame_count = len(audio) // frame
+    if frame_count == 0:
+        return [(0, len(audio))] if len(audio) else []
+
+    frames = audio[:frame_count * frame].reshape(frame_count, frame)
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    # With no real pauses the 10th-percentile "noise floor" is itself speech,
+    # so the threshold is capped relative to the loudest frame
+    noise_floor = float(np.percentile(rms, 10))
+    threshold = max(VAD_MIN_RMS, min(noise_floor * VAD_NOISE_MULTIPLIER, float(rms.max()) * VAD_MAX_THRESHOLD_RATIO))
+    speech = np.concatenate(([False], rms > threshold, [False]))
+
+    edges = np.flatnonzero(speech[1:] != speech[:-1])
+    runs = list(zip(edges[::2], edges[1::2]))
+    if not runs:
+        return []
+
+    max_gap = VAD_MIN_SILENCE_MS // VAD_FRAME_MS
+    merged = [list(runs[0])]
+    for start, end in runs[1:]:
+        if start - merged[-1][1] <= max_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    pad = int(sample_rate * VAD_SPEECH_PAD_MS / 1000)
+    return [
+        (max(0, start * frame - pad), min(len(audio), end * frame + pad))
+        for start, end in merged
+    ]
+
+def plan_transcription_chunks(audio, sample_rate=WHISPER_SAMPLE_RATE):
+    """
+    Drop silence and pack the remaining speech segments, in order, into
+    chunks of at most WHISPER_CHUNK_MAX_S seconds.
+    """
+    max_len = int(WHISPER_CHUNK_MAX_S * sample_rate)
+    gap = np.zeros(int(0.2 * sample_rate), dtype=np.float32)
+
+    pieces = []
+    for start, end in detect_speech_segments(audio, sample_rate):
+        # A single segment longer than a chunk is split hard
+        for piece_start in range(start, end, max_len):
+            pieces.append(audio[piece_start:min(end, piece_start + max_len)])
+
+    chunks, current, current_len = [], [], 0
+    for piece in pieces:
+        if current and current_len + len(gap) + len(piece) > max_len:
+            chunks.append(np.concatenate(current))
+            current, current_len = [], 0
+        if current:
+            current.append(gap)
+            current_len += len(gap)
+        current.append(piece)
+        current_len += len(piece)
+    if current:
+        chunks.append(np.concatenate(current))
+    return chunks
+
+def get_whisper_pool():
+    """Worker processes for Whisper, each loading the model once at start"""
+    global whisper_pool
+    with _whisper_pool_lock:
+        if whisper_pool is None:
+            whisper_pool = ProcessPoolExecutor(
+                max_workers=WHISPER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=whisper_worker.init_worker,
+                initargs=(WHISPER_MODEL_SIZE,)
+            )
+        return whisper_pool
+
+def start_whisper_pool():
+    """Spawn the workers and wait until each has its model loaded"""
+    pool = get_whisper_pool()
+    for future in [pool.submit(whisper_worker.ping) for _ in range(WHISPER_WORKERS)]:
+        future.result()
+
+def run_whisper_chunks(chunks, options):
+    """
+    Transcribe chunks in the worker pool with a per-job deadline.
+    Waits up to WHISPER_QUEUE_TIMEOUT_S for a job slot.
+    """
+    global whisper_pool
+    if not whisper_job_slots.acquire(timeout=WHISPER_QUEUE_TIMEOUT_S):
+        raise WhisperBusyError("Voice transcription is busy, please try again shortly")
+    try:
+        futures = [get_whisper_pool().submit(whisper_worker.transcribe_chunk, chunk, options) for chunk in chunks]
+        done, not_done = wait(futures, timeout=WHISPER_JOB_TIMEOUT_S)
+        if not_done:
+            # Chunks that have not started are dropped; a chunk already
+            # running finishes in its worker and is discarded.
+            for future in not_done:
+                future.cancel()
+            raise TimeoutError(f"Transcription took longer than {WHISPER_JOB_TIMEOUT_S:g}s")
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool next time
+        with _whisper_pool_lock:
+            whisper_pool = None
+        raise
+    finally:
+        whisper_job_slots.release()
+
+@instrumented("whisper")
+def transcribe_audio_array(audio):
+    """
+    Transcribe the speech in a 16 kHz float32 array.
+    Chunks are decoded in parallel worker processes and stitched back in
+    order; the language is the one detected for most of the speech.
+    Returns: (text, detected_language, languages_by_chunk)
+    """
+    chunks = plan_transcription_chunks(audio)
+    if not chunks:
+        return "", "", []
+
+    MODEL_STATE['whisper'].ensure()
+
+    options = {"task": "transcribe"}
+    if WHISPER_WORKERS > 0:
+        results = run_whisper_chunks(chunks, options)
+    else:
+        results = []
+        for chunk in chunks:
+            result = whisper_model.transcribe(chunk, **options)
+            results.append({"text": result.get("text", "").strip(), "language": result.get("language", "")})
+
+    speech_by_language = {}
+    for chunk, result in zip(chunks, results):
+        speech_by_language[result["language"]] = speech_by_language.get(result["language"], 0) + len(chunk)
+    detected_lang = max(speech_by_language, key=speech_by_language.get)
+
+    text = " ".join(result["text"] for result in results if result["text"])
+    return text, detected_lang, [result["language"] for result in results]
+
+def transcribe_upload(data):
+    """Transcribe uploaded audio bytes. Returns (roman_text, detected_language)."""
+    audio = decode_audio_bytes(data)
+    text, detected_lang, chunk_languages = transcribe_audio_array(audio)
+    if not text.strip():
+        raise NoSpeechError("No speech detected in the recording, please try again 🎤")
+
+    # urdu_to_roman only maps Urdu-script characters, so it is safe on
+    # stitched text where only some chunks were Urdu
+    if "ur" in chunk_languages:
+        roman_text = urdu_to_roman(text)
+    else:
+        roman_text = text
+    return roman_text, detected_lang
+
+# ============= PROGRESSIVE STREAMING =============
+
+def wants_sse():
+    """SSE when asked for via Accept or ?format=sse, NDJSON otherwise"""
+    if request.args.get("format", "").lower() == "sse":
+        return True
+    return any(mimetype == "text/event-stream" for mimetype, _ in request.accept_mimetypes)
+
+def format_stream_event(event, data, sse):
+    payload = json.dumps(data, ensure_ascii=False)
+    if sse:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+def iter_full_analysis_events(emotion_result, english_text, personalize=False):
+    """
+    Yield (event, data) pairs for every analysis stage as it finishes:
+    recommendations, entertainment, captions, one 'meme' per rendered meme,
+    then 'done'.
+    """
+    events = queue.Queue()
+
+    def on_stage_done(name, value):
+        # Memes are already sent one by one as they render
+        if name != "memes":
+            events.put((name, value))
+
+    def run():
+        try:
+            _, incomplete = build_full_analysis(
+                emotion_result, english_text,
+                on_stage_done=on_stage_done,
+                on_meme=lambda meme: events.put(("meme", meme)),
+                personalize=personalize
+            )
+            events.put(("done", {"success": True, "incomplete_stages": incomplete}))
+        except Exception as e:
+            print(f"Error in streamed analysis: {e}")
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, name="analysis-stream", daemon=True).start()
+    while True:
+        item = events.get()
+        if item is None:
+            return
+        yield item
+
+def stream_response(events, sse):
+    def generate():
+        try:
+            for event, data in events:
+                yield format_stream_event(event, data, sse)
+        except Exception as e:
+            print(f"Error in analysis stream: {e}")
+            yield format_stream_event("error", {"error": str(e)}, sse)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ============= BATCH ANALYSIS =============
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+# Recommendation calls in flight at once, shared by all batch requests
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+batch_llm_executor = ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY, thread_name_prefix="batch-llm")
+
+def normalize_batch_items(items):
+    """Accept plain strings or {'id', 'text'} objects. Returns [(id, text)]."""
+    normalized = []
+    for i, item in enumerate(items):
+        if isinstance(item, dict):
+            item_id, text = item.get('id', i), item.get('text')
+        else:
+            item_id, text = i, item
+        normalized.append((item_id, text.strip() if isinstance(text, str) else ''))
+    return normalized
+
+def analyze_batch(items, include_recommendations=True):
+    """
+    Translate, classify and (optionally) write recommendations for many
+    texts. Translation and classification run in bulk; recommendations
+    run on batch_llm_executor. One failing item never fails the rest.
+    """
+    results = [{'index': i, 'id': item_id} for i, (item_id, _) in enumerate(items)]
+    valid = [i for i, (_, text) in enumerate(items) if text]
+    for i, (_, text) in enumerate(items):
+        if not text:
+            results[i].update({'success': False, 'error': 'No text provided'})
+
+    english_texts = translate_texts([items[i][1] for i in valid])
+    try:
+        emotions = analyze_emotions(english_texts)
+    except ModelNotReadyError:
+        raise
+    except Exception as e:
+        # Find the item that broke the batch instead of failing all of them
+        print(f"Batch emotion analysis failed, retrying items one by one: {e}")
+        emotions = []
+        for text in english_texts:
+            try:
+                emotions.append(analyze_emotion(text))
+            except Exception as item_error:
+                emotions.append(item_error)
+
+    pending = {}
+    for i, english_text, emotion_result in zip(valid, english_texts, emotions):
+        if isinstance(emotion_result, Exception):
+            results[i].update({'success': False, 'error': str(emotion_result)})
+            continue
+        results[i].update({
+            'success': True,
+            'emotion': emotion_result['emotion'],
+            'confidence': emotion_result['confidence'],
+            'top_emotions': emotion_result['top_emotions']
+        })
+        if include_recommendations:
+            future = batch_llm_executor.submit(
+                generate_recommendations, emotion_result['emotion'], emotion_result['confidence'], english_text
+            )
+            pending[future] = i
+
+    for future, i in pending.items():
+        try:
+            results[i]['message'] = future.result()
+        except Exception as e:
+            print(f"Recommendations failed for batch item {i}: {e}")
+            results[i]['message'] = fallback_recommendations(results[i]['emotion'])
+            results[i]['recommendations_error'] = str(e)
+
+    return results
+
 # ========== API ROUTES ==========
 
 @app.route('/api/test-gemini', methods=['GET'])
@@ -686,6 +3469,70 @@ def test_gemini():
 def health_check():
     return jsonify({'status': 'ok', 'message': 'Server is running'})
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe: 200 once every required model has loaded, 503 until
+    then. /api/health stays a liveness check.
+    """
+    models = {name: slot.status() for name, slot in MODEL_STATE.items()}
+    ready = all(slot.state == "ready" for slot in MODEL_STATE.values() if slot.required)
+    return jsonify({'ready': ready, 'models': models}), 200 if ready else 503
+
+def render_runtime_metrics():
+    """Gauges and counters read from existing components at scrape time"""
+    lines = ["# HELP vibecheck_model_ready Whether a model is loaded (1) or not (0)",
+             "# TYPE vibecheck_model_ready gauge"]
+    for name, slot in MODEL_STATE.items():
+        lines.append(f'vibecheck_model_ready{{model="{name}"}} {int(slot.state == "ready")}')
+
+    batcher = emotion_batcher.stats()
+    lines += ["# HELP vibecheck_emotion_queue_depth Texts waiting for the emotion batcher",
+              "# TYPE vibecheck_emotion_queue_depth gauge",
+              f"vibecheck_emotion_queue_depth {batcher['queue_depth']}",
+              "# HELP vibecheck_emotion_batches_total Batched forward passes run by the emotion batcher",
+              "# TYPE vibecheck_emotion_batches_total counter",
+              f"vibecheck_emotion_batches_total {batcher['batches']}"]
+
+    lines += ["# HELP vibecheck_gemini_circuit_open Whether the Gemini circuit breaker is open (1) or not (0)",
+              "# TYPE vibecheck_gemini_circuit_open gauge",
+              f"vibecheck_gemini_circuit_open {int(gemini_client.breaker.state == 'open')}",
+              "# HELP vibecheck_caption_bank_captions Captions currently in the caption bank",
+              "# TYPE vibecheck_caption_bank_captions gauge",
+              f"vibecheck_caption_bank_captions {caption_bank.size()}"]
+
+    cache = llm_cache.stats()["totals"]
+    lines += ["# HELP vibecheck_llm_cache_lookups_total LLM response cache lookups by result",
+              "# TYPE vibecheck_llm_cache_lookups_total counter"]
+    for result in ("memory_hits", "disk_hits", "misses"):
+        lines.append(f'vibecheck_llm_cache_lookups_total{{result="{result}"}} {cache[result]}')
+    return lines
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of latency histograms and counters"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += render_runtime_metrics()
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/emotion-batcher/stats', methods=['GET'])
+def emotion_batcher_stats():
+    return jsonify(emotion_batcher.stats())
+
+@app.route('/api/llm-cache/stats', methods=['GET'])
+def llm_cache_stats():
+    return jsonify(llm_cache.stats())
+
+@app.route('/api/caption-bank/stats', methods=['GET'])
+def caption_bank_stats():
+    return jsonify(caption_bank.stats())
+
+@app.route('/api/templates/stats', methods=['GET'])
+def template_stats():
+    return jsonify(template_index.stats())
+
 @app.route('/api/trackmood', methods=['POST'])
 def track_mood():
     """
@@ -714,10 +3561,43 @@ def track_mood():
             'message': recommendations
         })
         
+    except ModelNotReadyError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f"Error in track_mood: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/analyze-batch', methods=['POST'])
+def analyze_batch_endpoint():
+    """
+    Bulk mood analysis for backfills.
+    Body: {"items": ["text", {"id": "...", "text": "..."}, ...],
+           "recommendations": true}
+    Returns one result per item, in order, each with its own success/error.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Provide a non-empty "items" list'}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'Too many items ({len(items)}), the limit is {BATCH_MAX_ITEMS}'}), 413
+
+        results = analyze_batch(normalize_batch_items(items), bool(data.get('recommendations', True)))
+        failed = sum(1 for result in results if not result['success'])
+        return jsonify({
+            'success': failed < len(results),
+            'count': len(results),
+            'failed': failed,
+            'results': results
+        })
+
+    except ModelNotReadyError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        print(f"Error in analyze_batch: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/generatememes', methods=['POST'])
 def generate_memes_endpoint():
     """
@@ -733,16 +3613,8 @@ def generate_memes_endpoint():
         
         english_text = translate_text(text)
         emotion_result = analyze_emotion(english_text)
-        captions = generate_humorous_captions(emotion_result['emotion'], english_text)
-        
-        memes = []
-        for caption in captions:
-            meme_img = create_meme_image(emotion_result['emotion'], caption)
-            if meme_img:
-                memes.append({
-                    'caption': caption,
-                    'image': meme_img
-                })
+        captions = generate_humorous_captions(emotion_result['emotion'], english_text, personalize_requested(data))
+        memes = render_memes(emotion_result['emotion'], captions)
         
         return jsonify({
             'success': True,
@@ -750,6 +3622,8 @@ def generate_memes_endpoint():
             'memes': memes
         })
         
+    except ModelNotReadyError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f"Error in generate_memes: {e}")
         return jsonify({'error': str(e)}), 500
@@ -767,56 +3641,35 @@ def transcribe_audio():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-
-        result = whisper_model.transcribe(filepath, task="transcribe")
-        detected_lang = result.get("language", "")
-        text = result.get("text", "").strip()
-
-        if detected_lang == "ur":
-            roman_text = urdu_to_roman(text)
-        else:
-            roman_text = text
+        roman_text, detected_lang = transcribe_upload(file.read())
 
         english_text = translate_text(roman_text)
         emotion_result = analyze_emotion(english_text)
-        recommendations = generate_recommendations(
-            emotion_result['emotion'],
-            emotion_result['confidence'],
-            english_text
-        )
+        results, incomplete = build_full_analysis(emotion_result, english_text, personalize=personalize_requested())
 
-        entertainment_recs = generate_entertainment_recommendations(
-            emotion_result['emotion'],
-            emotion_result['confidence'],
-            english_text
-        )
-
-        captions = generate_humorous_captions(emotion_result['emotion'], english_text)
-        memes = []
-        for caption in captions:
-            meme_img = create_meme_image(emotion_result['emotion'], caption)
-            if meme_img:
-                memes.append({'caption': caption, 'image': meme_img})
-
-        try:
-            os.remove(filepath)
-        except Exception:
-            pass
-
-        return jsonify({
+        response = {
             'success': True,
             'transcription': roman_text,
             'detected_language': detected_lang,
             'emotion': emotion_result['emotion'],
             'confidence': emotion_result['confidence'],
-            'recommendations': recommendations,
-            'entertainment': entertainment_recs,
-            'memes': memes
-        })
-
+            'top_emotions': emotion_result['top_emotions'],
+            'emotion_distribution': emotion_result['distribution'],
+            'recommendations': results['recommendations'],
+            'entertainment': results['entertainment'],
+            'memes': results['memes']
+        }
+        if incomplete:
+            response['incomplete_stages'] = incomplete
+        return jsonify(response)
+
+    except NoSpeechError as e:
+        return jsonify({'error': str(e), 'no_speech': True}), 422
+    except (WhisperBusyError, ModelNotReadyError) as e:
+        return jsonify({'error': str(e)}), 503
+    except TimeoutError as e:
+        print(f"Timeout in transcribe_audio: {e}")
+        return jsonify({'error': str(e)}), 504
     except Exception as e:
         print(f"Error in transcribe_audio: {e}")
         return jsonify({'error': str(e)}), 500
@@ -835,43 +3688,94 @@ def analyze_complete():
         
         english_text = translate_text(text)
         emotion_result = analyze_emotion(english_text)
+        results, incomplete = build_full_analysis(emotion_result, english_text, personalize=personalize_requested(data))
         
-        recommendations = generate_recommendations(
-            emotion_result['emotion'],
-            emotion_result['confidence'],
-            english_text
-        )
-        
-        entertainment_recs = generate_entertainment_recommendations(
-            emotion_result['emotion'],
-            emotion_result['confidence'],
-            english_text
-        )
-        
-        captions = generate_humorous_captions(emotion_result['emotion'], english_text)
-        
-        memes = []
-        for caption in captions:
-            meme_img = create_meme_image(emotion_result['emotion'], caption)
-            if meme_img:
-                memes.append({
-                    'caption': caption,
-                    'image': meme_img
-                })
-        
-        return jsonify({
+        response = {
             'success': True,
             'emotion': emotion_result['emotion'],
             'confidence': emotion_result['confidence'],
-            'recommendations': recommendations,
-            'entertainment': entertainment_recs,
-            'memes': memes
-        })
+            'top_emotions': emotion_result['top_emotions'],
+            'emotion_distribution': emotion_result['distribution'],
+            'recommendations': results['recommendations'],
+            'entertainment': results['entertainment'],
+            'memes': results['memes']
+        }
+        if incomplete:
+            response['incomplete_stages'] = incomplete
+        return jsonify(response)
         
+    except ModelNotReadyError as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f"Error in analyze_complete: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/analyze-complete/stream', methods=['POST'])
+def analyze_complete_stream():
+    """
+    Streaming version of /api/analyze-complete.
+    Sends the emotion as soon as it is known, then each block as it finishes
+    (NDJSON by default, Server-Sent Events with Accept: text/event-stream).
+    """
+    data = request.get_json(silent=True) or {}
+    text = data.get('text', '').strip()
+    
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    personalize = personalize_requested(data)
+
+    def events():
+        english_text = translate_text(text)
+        emotion_result = analyze_emotion(english_text)
+        yield "emotion", {
+            'emotion': emotion_result['emotion'],
+            'confidence': emotion_result['confidence'],
+            'top_emotions': emotion_result['top_emotions'],
+            'emotion_distribution': emotion_result['distribution']
+        }
+        yield from iter_full_analysis_events(emotion_result, english_text, personalize)
+
+    return stream_response(events(), wants_sse())
+
+@app.route('/api/transcribe-audio/stream', methods=['POST'])
+def transcribe_audio_stream():
+    """
+    Streaming version of /api/transcribe-audio.
+    Sends the transcription, then the emotion, then each block as it finishes.
+    """
+    if 'audio' not in request.files:
+        return jsonify({'error': 'No audio file provided'}), 400
+
+    file = request.files['audio']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    audio_bytes = file.read()
+    personalize = personalize_requested()
+
+    def events():
+        try:
+            roman_text, detected_lang = transcribe_upload(audio_bytes)
+        except NoSpeechError as e:
+            yield "error", {'error': str(e), 'no_speech': True}
+            return
+        yield "transcription", {
+            'transcription': roman_text,
+            'detected_language': detected_lang
+        }
+
+        english_text = translate_text(roman_text)
+        emotion_result = analyze_emotion(english_text)
+        yield "emotion", {
+            'emotion': emotion_result['emotion'],
+            'confidence': emotion_result['confidence'],
+            'top_emotions': emotion_result['top_emotions'],
+            'emotion_distribution': emotion_result['distribution']
+        }
+        yield from iter_full_analysis_events(emotion_result, english_text, personalize)
+
+    return stream_response(events(), wants_sse())
+
 @app.route('/api/debug-judging', methods=['POST'])
 def debug_judging():
     """
@@ -914,17 +3818,34 @@ def debug_judging():
         return jsonify({'error': str(e)}), 500
 
 
-if __name__ == '__main__':
+def run_server():
+    """
+    Start the dev server. Prefer `python server.py`: spawned Whisper workers
+    re-import the __main__ module, so under `python app.py` each of them also
+    imports this whole module on top of loading its own model.
+    """
     print("🌈 Starting VibeCheck Backend Server...")
     setup_models()
-    print("✅ All models loaded successfully!")
+    print("⏳ Models are loading in the background, GET /api/ready reports when they are usable")
     print("📡 Backend running on http://localhost:5000")
     print("\n📋 Available Endpoints:")
     print("  POST /api/trackmood - Track mood and get recommendations")
+    print("  POST /api/analyze-batch - Emotion + recommendations for many entries at once")
     print("  POST /api/generatememes - Generate memes with captions")
     print("  POST /api/transcribe-audio - Transcribe voice recording")
     print("  POST /api/analyze-complete - Complete analysis (all features)")
+    print("  POST /api/analyze-complete/stream - Complete analysis, streamed as each part finishes")
+    print("  POST /api/transcribe-audio/stream - Voice analysis, streamed as each part finishes")
     print("  POST /api/debug-judging - Debug endpoint to see judge scoring breakdown")
     print("  GET  /api/health - Health check")
+    print("  GET  /api/ready - Readiness check with per-model load state")
+    print("  GET  /metrics - Prometheus latency histograms and counters")
+    print("  GET  /api/emotion-batcher/stats - Emotion batching queue/batch-size stats")
+    print("  GET  /api/llm-cache/stats - LLM response cache hit/miss counters")
+    print("  GET  /api/caption-bank/stats - Banked captions per emotion and fill counters")
+    print("  GET  /api/templates/stats - Meme template index and decode cache stats")
     print("  GET  /api/test-gemini - Test Gemini connection")
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
+
+if __name__ == '__main__':
+    run_server()
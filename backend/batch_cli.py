@@ -0,0 +1,196 @@
+"""
+Offline batch mode: label a JSONL corpus without running the web server.
+
+Each input line is a JSON object with a text field (and optionally an id).
+Lines are read lazily, processed in chunks across a pool of worker
+processes (each loads its own emotion model once) and written to the
+output JSONL in input order as soon as each chunk is done.
+
+After every written chunk a checkpoint records how many input lines are
+done and how long the output is, so a killed run picks up where it left
+off when started again with the same arguments.
+
+Run from the backend folder:
+    python batch_cli.py entries.jsonl labels.jsonl --workers 4
+    python batch_cli.py entries.jsonl labels.jsonl --recommendations
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import app
+
+# ============= WORKER PROCESS =============
+
+_worker_options = {}
+
+def init_worker(backend, threads, recommendations):
+    """Load the emotion model (and Gemini if needed) once per process"""
+    app.EMOTION_BACKEND = backend
+    app.EMOTION_NUM_THREADS = threads
+    app.MODEL_STATE['emotion'].ensure(timeout=3600)
+    if recommendations:
+        app.configure_gemini()
+    _worker_options['recommendations'] = recommendations
+
+def process_chunk(records):
+    """
+    Label one chunk of (line_number, id, text, error) records.
+    Returns one output dict per record, in the same order.
+    """
+    items = [(item_id, text or '') for _, item_id, text, _ in records]
+    try:
+        results = app.analyze_batch(items, _worker_options['recommendations'])
+    except app.ModelNotReadyError:
+        raise
+    except Exception as e:
+        results = [{'id': item_id, 'success': False, 'error': str(e)} for item_id, _ in items]
+
+    output = []
+    for (line_number, _, _, error), result in zip(records, results):
+        result.pop('index', None)
+        if error:
+            result = {'id': result['id'], 'success': False, 'error': error}
+        output.append({'line': line_number, **result})
+    return output
+
+# ============= INPUT / CHECKPOINT =============
+
+def read_records(path, text_field, id_field, skip_lines):
+    """Yield (line_number, id, text, error) for every non-blank input line after skip_lines"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if line_number <= skip_lines or not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, line_number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(entry, dict):
+                yield line_number, line_number, None, "Expected a JSON object"
+                continue
+            text = entry.get(text_field)
+            yield line_number, entry.get(id_field, line_number), text if isinstance(text, str) else None, None
+
+def chunked(records, size):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+def load_checkpoint(path, args):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('input') != os.path.abspath(args.input) or checkpoint.get('output') != os.path.abspath(args.output):
+        sys.exit(f"❌ Checkpoint {path} belongs to a different input/output pair")
+    return checkpoint
+
+def save_checkpoint(path, args, lines_done, output_offset, processed):
+    checkpoint = {
+        'input': os.path.abspath(args.input),
+        'output': os.path.abspath(args.output),
+        'lines_done': lines_done,
+        'output_offset': output_offset,
+        'processed': processed,
+        'updated_at': time.time()
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+# ============= DRIVER =============
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of entries")
+    parser.add_argument("output", help="JSONL file to write results to")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--workers", type=int, default=max(1, cpus // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="torch/ONNX threads per worker (default: cores / workers)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="entries per task sent to a worker")
+    parser.add_argument("--max-pending", type=int, default=0,
+                        help="chunks in flight at once (default: 2 x workers)")
+    parser.add_argument("--backend", default=app.EMOTION_BACKEND, choices=app.EMOTION_BACKENDS)
+    parser.add_argument("--recommendations", action="store_true", help="also generate Gemini recommendations")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint.json)")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and overwrite the output")
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    threads = args.threads_per_worker or max(1, cpus // workers)
+    max_pending = args.max_pending or workers * 2
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint.json"
+
+    checkpoint = None if args.restart else load_checkpoint(checkpoint_path, args)
+    if checkpoint:
+        lines_done, processed = checkpoint['lines_done'], checkpoint['processed']
+        with open(args.output, "r+b") as f:
+            f.truncate(checkpoint['output_offset'])
+        print(f"↩️ Resuming after line {lines_done:,} ({processed:,} entries already written)")
+    else:
+        if os.path.exists(args.output) and os.path.getsize(args.output) and not args.restart:
+            sys.exit(f"❌ {args.output} already exists; pass --restart to overwrite it")
+        lines_done, processed = 0, 0
+        open(args.output, "wb").close()
+
+    print(f"🚀 Labelling {args.input} with {workers} workers x {threads} threads ({args.backend})...")
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(args.backend, threads, args.recommendations)
+    )
+
+    started = time.monotonic()
+    processed_at_start = processed
+    chunks = chunked(read_records(args.input, args.text_field, args.id_field, lines_done), args.chunk_size)
+    pending = deque()
+    try:
+        with open(args.output, "ab") as out:
+            while True:
+                # Keep a bounded window of chunks in flight so memory stays flat
+                while len(pending) < max_pending:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append((chunk[-1][0], len(chunk), pool.submit(process_chunk, chunk)))
+                if not pending:
+                    break
+
+                last_line, size, future = pending.popleft()
+                for result in future.result():
+                    out.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+                out.flush()
+                os.fsync(out.fileno())
+
+                lines_done, processed = last_line, processed + size
+                save_checkpoint(checkpoint_path, args, lines_done, out.tell(), processed)
+                rate = (processed - processed_at_start) / max(time.monotonic() - started, 1e-9)
+                print(f"📦 {processed:,} entries done (line {lines_done:,}, {rate:,.1f}/s)", flush=True)
+    except KeyboardInterrupt:
+        print(f"\n⏸️ Interrupted; run the same command again to resume after line {lines_done:,}")
+        pool.shutdown(wait=False, cancel_futures=True)
+        sys.exit(130)
+    pool.shutdown()
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(f"✅ Done: {processed:,} entries written to {args.output}")
+
+if __name__ == "__main__":
+    main()
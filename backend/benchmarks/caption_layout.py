@@ -0,0 +1,71 @@
+"""
+Benchmark: cached caption layout vs. the original textlength() wrap loop.
+
+Run from the backend folder:
+    python benchmarks/caption_layout.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import Image, ImageDraw
+
+import app
+
+ROMAN_URDU_PHRASES = [
+    "yaar aaj ka din bohat lamba tha",
+    "exam ki tension mein neend bhi nahi aayi",
+    "chai ke baghair zindagi adhoori lagti hai",
+    "boss ne phir se weekend pe kaam de diya",
+    "ammi ne kaha beta thori si nind kar lo",
+    "dil chahta hai sab chor ke pahar chala jaun",
+]
+
+def make_caption(word_count):
+    words = " ".join(ROMAN_URDU_PHRASES).split()
+    return " ".join(words[i % len(words)] for i in range(word_count))
+
+def legacy_wrap(draw, caption, font, max_width):
+    """The original create_meme_image() wrap loop, kept for comparison"""
+    lines, line = [], ""
+    for word in caption.split():
+        test_line = line + word + " "
+        if draw.textlength(test_line, font=font) <= max_width:
+            line = test_line
+        else:
+            if line:
+                lines.append(line.strip())
+            line = word + " "
+    if line:
+        lines.append(line.strip())
+    return [(l, draw.textlength(l, font=font)) for l in lines]
+
+def main():
+    image_width = 800
+    font_size = max(20, image_width // 25)
+    max_width = image_width - 40
+    face = app.CAPTION_FONT_FACE
+    font = app.load_caption_font(face, font_size)
+    draw = ImageDraw.Draw(Image.new("RGBA", (image_width, image_width)))
+    uncached_layout = app.layout_caption.__wrapped__
+
+    print(f"{'words':>6} {'lines':>6} {'legacy ms':>10} {'linear ms':>10} {'memo ms':>9} {'same breaks':>12}")
+    for word_count in (10, 50, 200, 500, 1000):
+        caption = make_caption(word_count)
+        number = max(1, 2000 // word_count)
+
+        legacy = legacy_wrap(draw, caption, font, max_width)
+        linear = uncached_layout(caption, max_width, font_size, face)
+        same = [l for l, _ in legacy] == [l for l, _ in linear]
+
+        legacy_ms = timeit.timeit(lambda: legacy_wrap(draw, caption, font, max_width), number=number) / number * 1000
+        linear_ms = timeit.timeit(lambda: uncached_layout(caption, max_width, font_size, face), number=number) / number * 1000
+        app.layout_caption(caption, max_width, font_size, face)
+        memo_ms = timeit.timeit(lambda: app.layout_caption(caption, max_width, font_size, face), number=number) / number * 1000
+
+        print(f"{word_count:>6} {len(linear):>6} {legacy_ms:>10.3f} {linear_ms:>10.3f} {memo_ms:>9.4f} {str(same):>12}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Parity check and latency benchmark for the emotion classifier backends.
+
+Compares each backend's label distributions with the fp32 torch pipeline on
+a fixed corpus, then times single-text and batched calls.
+
+Run from the backend folder:
+    python benchmarks/emotion_backend.py --backends torch-int8 onnx onnx-int8
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app
+
+CORPUS = [
+    "I finally got the job offer, I can't stop smiling!",
+    "Thank you so much for staying with me last night.",
+    "I am so tired of being ignored at work.",
+    "Why does everyone keep cancelling on me?",
+    "My grandmother passed away this morning.",
+    "I miss how things used to be before we moved.",
+    "That joke had me laughing for ten minutes straight.",
+    "I'm really nervous about my exam tomorrow.",
+    "I can't believe they lied to me again.",
+    "Wow, I did not expect that ending at all!",
+    "I'm proud of how far I've come this year.",
+    "Honestly I don't know what I'm supposed to do now.",
+    "I wonder what the city looks like at night.",
+    "That was disgusting, I can't even look at it.",
+    "I'm sorry, I shouldn't have yelled at you.",
+    "Phew, the results came back negative.",
+    "I love spending Sundays with my family.",
+    "I really want that new phone so badly.",
+    "I'm so embarrassed, everyone saw me trip.",
+    "Things will get better, I can feel it.",
+    "Oh, now I get why it wasn't working.",
+    "You should try talking to a counselor about it.",
+    "I approve of the new schedule, it makes sense.",
+    "Nobody cares about what I think anyway.",
+    "I'm scared to walk home alone in the dark.",
+    "This is fine. Everything is fine.",
+    "Can't wait for the concert this weekend!!",
+    "I'm annoyed that the bus was late again.",
+    "It's just another ordinary Tuesday.",
+    "You did an amazing job on that presentation.",
+    "I feel empty and I don't know why.",
+    "kal exam hai aur kuch bhi yaad nahi",
+]
+
+def score_matrix(pipe, texts):
+    results = pipe(texts, batch_size=len(texts))
+    labels = [item["label"] for item in results[0]]
+    return labels, np.array([[item["score"] for item in row] for row in results])
+
+def time_calls(pipe, texts, batch_size, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            pipe(texts[i:i + batch_size], batch_size=batch_size)
+        samples.append((time.perf_counter() - start) * 1000 / len(texts))
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["torch-int8", "onnx", "onnx-int8"],
+                        choices=app.EMOTION_BACKENDS)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-top1-agreement", type=float, default=0.9)
+    parser.add_argument("--max-mean-abs-diff", type=float, default=0.02)
+    args = parser.parse_args()
+
+    reference = app.load_emotion_pipeline("torch")
+    ref_labels, ref_scores = score_matrix(reference, CORPUS)
+    ref_top = ref_scores.argmax(axis=1)
+    ref_top3 = np.argsort(-ref_scores, axis=1)[:, :3]
+
+    rows = [("torch", 1.0, 1.0, 0.0, 0.0, reference)]
+    failed = False
+    for backend in args.backends:
+        pipe = app.load_emotion_pipeline(backend)
+        labels, scores = score_matrix(pipe, CORPUS)
+        if labels != ref_labels:
+            order = [labels.index(label) for label in ref_labels]
+            scores = scores[:, order]
+
+        diff = np.abs(scores - ref_scores)
+        top1 = float(np.mean(scores.argmax(axis=1) == ref_top))
+        top3 = float(np.mean([len(set(a) & set(b)) / 3 for a, b in zip(np.argsort(-scores, axis=1)[:, :3], ref_top3)]))
+        rows.append((backend, top1, top3, float(diff.mean()), float(diff.max()), pipe))
+        if top1 < args.min_top1_agreement or diff.mean() > args.max_mean_abs_diff:
+            failed = True
+
+    print(f"{'backend':<12} {'top1 agree':>10} {'top3 overlap':>12} {'mean |diff|':>11} {'max |diff|':>10} "
+          f"{'ms/text b=1':>11} {'ms/text b=16':>12}")
+    for backend, top1, top3, mean_diff, max_diff, pipe in rows:
+        single = time_calls(pipe, CORPUS, 1, args.repeats)
+        batched = time_calls(pipe, CORPUS, 16, args.repeats)
+        print(f"{backend:<12} {top1:>10.3f} {top3:>12.3f} {mean_diff:>11.4f} {max_diff:>10.4f} "
+              f"{single:>11.2f} {batched:>12.2f}")
+
+    if failed:
+        print(f"\n❌ Parity check failed (need top1 >= {args.min_top1_agreement}, "
+              f"mean |diff| <= {args.max_mean_abs_diff})")
+        sys.exit(1)
+    print("\n✅ All backends within parity thresholds")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Offline load test for the Flask endpoints.
+
+Replays a recorded request mix (benchmarks/workload.jsonl) against the real
+app through Flask's test client, with Gemini, googletrans, the emotion model
+and Whisper replaced by the local stand-ins in benchmarks/stand_ins.py.
+Reports p50/p95/p99 per endpoint and per pipeline stage, and compares the
+run with a committed baseline to catch regressions.
+
+Run from the backend folder:
+    python benchmarks/load_test.py                       # run and compare with baseline.json
+    python benchmarks/load_test.py --update-baseline     # record a new baseline
+    python benchmarks/load_test.py --pace closed --concurrency 8 --rounds 3
+
+With --pace recorded (the default) requests are sent at their recorded
+arrival times, and latency is measured from that scheduled time, so
+queueing delay counts against the server. --pace closed keeps a fixed
+number of requests in flight instead.
+
+The replay is repeated --repeats times, each in a fresh process so caches
+start cold, and every statistic is the median across those runs. A single
+run has only a dozen samples per stage, so its p95 is mostly noise.
+Comparing with a baseline recorded under different settings (including
+voice requests skipped for lack of ffmpeg) is refused.
+"""
+import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import multiprocessing
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+import stand_ins
+
+DEFAULT_WORKLOAD = os.path.join(BENCH_DIR, "workload.jsonl")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# app.py functions timed as pipeline stages
+STAGE_FUNCTIONS = [
+    "translate_text",
+    "translate_texts",
+    "analyze_emotions",
+    "generate_recommendations",
+    "generate_entertainment_recommendations",
+    "generate_humorous_captions",
+    "judge_caption_candidates",
+    "render_memes",
+    "decode_audio_bytes",
+    "transcribe_audio_array",
+]
+
+class Samples:
+    """Thread-safe latency samples (ms) and error counts by name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, name, ms, error=False):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(ms)
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            items = {name: list(values) for name, values in self.latencies.items()}
+            errors = dict(self.errors)
+        summary = {}
+        for name in sorted(items):
+            values = np.asarray(items[name])
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[name] = {
+                "count": len(values),
+                "errors": errors.get(name, 0),
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+                "mean_ms": round(float(values.mean()), 1),
+            }
+        return summary
+
+def combine_runs(summaries):
+    """Median of each statistic across repeated runs; counts and errors are summed"""
+    combined = {}
+    for name in sorted(set().union(*summaries)):
+        rows = [summary[name] for summary in summaries if name in summary]
+        combined[name] = {
+            "count": sum(row["count"] for row in rows),
+            "errors": sum(row["errors"] for row in rows),
+        }
+        for key in ("p50_ms", "p95_ms", "p99_ms", "mean_ms"):
+            combined[name][key] = round(float(np.median([row[key] for row in rows])), 1)
+    return combined
+
+# ============= STAND-IN WIRING =============
+
+def instrument(app, stages):
+    """Wrap pipeline functions in app so every call records a stage sample"""
+    def timed(name, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                stages.add(name, (time.perf_counter() - started) * 1000, error=failed)
+        return wrapper
+
+    for name in STAGE_FUNCTIONS:
+        setattr(app, name, timed(name, getattr(app, name)))
+
+    safe_generate = app.safe_gemini_generate
+    @functools.wraps(safe_generate)
+    def timed_gemini(prompt, *args, call_site=None, **kwargs):
+        started = time.perf_counter()
+        result = safe_generate(prompt, *args, call_site=call_site, **kwargs)
+        stages.add(f"gemini:{call_site or 'uncached'}", (time.perf_counter() - started) * 1000, error=result is None)
+        return result
+    app.safe_gemini_generate = timed_gemini
+
+def wire_stand_ins(app, args, memes_dir):
+    gemini = stand_ins.FakeGeminiModel(
+        latency_scale=args.gemini_latency_scale,
+        jitter=args.gemini_jitter,
+        judge_score=args.judge_score,
+        low_score_rate=args.low_score_rate,
+        error_rate=args.gemini_error_rate,
+        seed=args.seed
+    )
+    app.gemini_model = gemini
+    app.translator = stand_ins.FakeTranslator(args.translate_ms)
+
+    if args.emotion_model:
+        app.EMOTION_MODEL_NAME = args.emotion_model
+    else:
+        app.load_emotion_pipeline = lambda backend=None: stand_ins.FakeEmotionPipeline(
+            args.emotion_call_ms, args.emotion_text_ms
+        )
+    app.whisper_worker.load_model = lambda size: stand_ins.FakeWhisperModel(args.whisper_realtime_factor)
+    app.WHISPER_WORKERS = 0
+
+    os.makedirs(memes_dir, exist_ok=True)
+    app.MEMES_OUTPUT_FOLDER = memes_dir
+    app.template_index.refresh()
+    app.MODEL_STATE['emotion'].ensure(timeout=600)
+    app.MODEL_STATE['whisper'].ensure(timeout=600)
+    return gemini
+
+# ============= WORKLOAD =============
+
+def synthesize_wav(seconds, speech, sample_rate=16000, seed=0):
+    """Tone bursts in the speech spans over low noise, as 16-bit mono WAV bytes"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = rng.normal(0, 0.003, len(t))
+    for start, end in speech:
+        span = (t >= start) & (t < end)
+        audio[span] += 0.3 * np.sin(2 * np.pi * 220 * t[span]) * (1 + 0.5 * np.sin(2 * np.pi * 3 * t[span]))
+    pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+def load_workload(path, include_audio):
+    entries, skipped = [], 0
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "audio" in entry:
+                if not include_audio:
+                    skipped += 1
+                    continue
+                spec = entry["audio"]
+                entry["audio_bytes"] = synthesize_wav(spec["seconds"], spec.get("speech", [[0, spec["seconds"]]]), seed=i)
+            entries.append(entry)
+    return entries, skipped
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+# ============= LOAD GENERATOR =============
+
+def send(client, entry, scheduled_at, endpoints):
+    """Issue one workload request and record its latency from scheduled_at"""
+    endpoint = entry["endpoint"]
+    error = False
+    try:
+        if "audio_bytes" in entry:
+            data = {"audio": (io.BytesIO(entry["audio_bytes"]), "recording.wav")}
+            response = client.post(endpoint, data=data, content_type="multipart/form-data", buffered=False)
+        else:
+            response = client.post(endpoint, json=entry.get("json", {}), buffered=False)
+
+        if endpoint.endswith("/stream"):
+            first = True
+            for chunk in response.response:
+                if first:
+                    endpoints.add(f"{endpoint} (first event)", (time.perf_counter() - scheduled_at) * 1000)
+                    first = False
+                if b'"event": "error"' in chunk:
+                    error = True
+        else:
+            response.get_data()
+        error = error or response.status_code != 200
+        response.close()
+    except Exception as e:
+        print(f"⚠️ {endpoint} raised {e}", file=sys.__stdout__)
+        error = True
+    endpoints.add(endpoint, (time.perf_counter() - scheduled_at) * 1000, error=error)
+
+def run_load(app, entries, args, endpoints):
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = app.app.test_client()
+        return local.client
+
+    schedule = [entry for _ in range(args.rounds) for entry in entries]
+    started = time.perf_counter()
+    if args.pace == "closed":
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for entry in schedule:
+                pool.submit(lambda e=entry: send(client(), e, time.perf_counter(), endpoints))
+    else:
+        duration = max(entry.get("at", 0) for entry in entries) + 1
+        with ThreadPoolExecutor(max_workers=args.max_in_flight) as pool:
+            for i, entry in enumerate(schedule):
+                offset = (i // len(entries)) * duration + entry.get("at", 0)
+                scheduled_at = started + offset / args.speed
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send, client(), entry, scheduled_at, endpoints)
+    return time.perf_counter() - started
+
+# ============= REPORTING =============
+
+def print_table(title, summary, baseline=None):
+    print(f"\n{title}")
+    print(f"  {'name':<44} {'n':>5} {'err':>4} {'p50':>9} {'p95':>9} {'p99':>9}" + ("  p95 vs baseline" if baseline else ""))
+    for name, row in summary.items():
+        line = (f"  {name:<44} {row['count']:>5} {row['errors']:>4} "
+                f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+        base = (baseline or {}).get(name)
+        if base and base.get("p95_ms"):
+            line += f"  {(row['p95_ms'] / base['p95_ms'] - 1) * 100:+6.1f}%"
+        print(line)
+
+def find_regressions(results, baseline, tolerance, min_delta_ms):
+    regressions = []
+    for section in ("endpoints", "stages"):
+        for name, base in (baseline.get(section) or {}).items():
+            current = results[section].get(name)
+            if current is None or base.get("p95_ms") is None:
+                continue
+            delta = current["p95_ms"] - base["p95_ms"]
+            if delta > min_delta_ms and current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{section}/{name}: p95 {base['p95_ms']:.1f} -> {current['p95_ms']:.1f} ms")
+            if current["errors"] > base.get("errors", 0):
+                regressions.append(f"{section}/{name}: errors {base.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+def replay(args, include_audio):
+    """One full replay against a freshly imported app; runs in its own process"""
+    workdir = tempfile.mkdtemp(prefix="vibecheck-bench-")
+    os.environ["LLM_CACHE_DB_PATH"] = os.path.join(workdir, "llm_cache.sqlite3")
+    os.environ["CAPTION_BANK_DB_PATH"] = os.path.join(workdir, "caption_bank.sqlite3")
+    stand_ins.install_sdk_stubs()
+    os.chdir(os.path.join(BENCH_DIR, ".."))
+    import app
+
+    endpoints, stages = Samples(), Samples()
+    entries, skipped = load_workload(args.workload, include_audio)
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    if quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+            gemini = wire_stand_ins(app, args, os.path.join(workdir, "memes"))
+            instrument(app, stages)
+            print(f"🏁 Replaying {len(entries)} requests x {args.rounds} ({args.pace})...", file=sys.__stdout__)
+            elapsed = run_load(app, entries, args, endpoints)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "skipped_audio_requests": skipped,
+        "elapsed_s": round(elapsed, 2),
+        "gemini_calls": dict(sorted(gemini.calls.items())),
+        "endpoints": endpoints.summary(),
+        "stages": stages.summary(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workload", default=DEFAULT_WORKLOAD)
+    parser.add_argument("--pace", choices=["recorded", "closed"], default="recorded")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed for --pace recorded")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight for --pace closed")
+    parser.add_argument("--max-in-flight", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=1, help="times to replay the workload")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="independent runs, each in a fresh process; statistics are the median across runs")
+    parser.add_argument("--no-audio", action="store_true", help="skip voice requests")
+    parser.add_argument("--gemini-latency-scale", type=float, default=0.1,
+                        help="multiplier on stand_ins.GEMINI_LATENCY_MS")
+    parser.add_argument("--gemini-jitter", type=float, default=0.3, help="lognormal sigma of Gemini latency")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--judge-score", type=int, default=8)
+    parser.add_argument("--low-score-rate", type=float, default=0.25,
+                        help="share of captions the fake judge scores low (triggers reflection)")
+    parser.add_argument("--translate-ms", type=float, default=150)
+    parser.add_argument("--emotion-call-ms", type=float, default=15)
+    parser.add_argument("--emotion-text-ms", type=float, default=4)
+    parser.add_argument("--emotion-model", help="local model folder to use instead of the fake classifier")
+    parser.add_argument("--whisper-realtime-factor", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the full results JSON here")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed p95 growth before failing")
+    parser.add_argument("--min-delta-ms", type=float, default=10.0, help="ignore p95 changes smaller than this")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's console output")
+    args = parser.parse_args()
+
+    include_audio = not args.no_audio and shutil.which("ffmpeg") is not None
+    if not args.no_audio and not include_audio:
+        print("⚠️ ffmpeg not found on PATH, skipping voice requests")
+
+    runs = []
+    for _ in range(max(1, args.repeats)):
+        # A new process per run, so no cache or warmed model leaks between runs
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            runs.append(pool.submit(replay, args, include_audio).result())
+
+    calls = sorted(set().union(*(run["gemini_calls"] for run in runs)))
+    results = {
+        "meta": {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+            "workload": os.path.basename(args.workload),
+            "workload_sha256": file_digest(args.workload),
+            "skipped_audio_requests": runs[0]["skipped_audio_requests"],
+            "elapsed_s": [run["elapsed_s"] for run in runs],
+            "config": {key: value for key, value in vars(args).items()
+                       if key not in ("out", "baseline", "update_baseline", "verbose", "tolerance", "min_delta_ms", "workload")},
+        },
+        "gemini_calls": {kind: int(np.median([run["gemini_calls"].get(kind, 0) for run in runs])) for kind in calls},
+        "endpoints": combine_runs([run["endpoints"] for run in runs]),
+        "stages": combine_runs([run["stages"] for run in runs]),
+    }
+
+    baseline = None
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print_table(f"Endpoints (ms, median of {len(runs)} runs)", results["endpoints"], baseline and baseline.get("endpoints"))
+    print_table(f"Stages (ms, median of {len(runs)} runs)", results["stages"], baseline and baseline.get("stages"))
+    print(f"\nGemini calls per run: {results['gemini_calls']}")
+    print("Elapsed per run: " + ", ".join(f"{run['elapsed_s']:.1f}s" for run in runs))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"\n💾 Baseline written to {args.baseline}")
+        return
+
+    if baseline is None:
+        print(f"\nℹ️ No baseline at {args.baseline}; run with --update-baseline to record one")
+        return
+    mismatched = [key for key in ("config", "workload_sha256", "skipped_audio_requests")
+                  if baseline.get("meta", {}).get(key) != results["meta"][key]]
+    if mismatched:
+        print(f"\n❌ Baseline was recorded with a different {', '.join(mismatched)}; not comparing. "
+              "Rerun with the baseline's settings or record a new baseline with --update-baseline")
+        sys.exit(2)
+
+    regressions = find_regressions(results, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) vs baseline (tolerance {args.tolerance:.0%}):")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+    print("\n✅ No regressions vs baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Local stand-ins for the external services and models used by app.py, so the
+real Flask endpoints can be benchmarked offline.
+
+- FakeGeminiModel answers every prompt app.py sends (judge, reflection,
+  captions, recommendations, entertainment) with canned text in the format
+  its parsers expect, after a configurable, jittered latency.
+- FakeTranslator mimics googletrans (single and list input).
+- FakeEmotionPipeline mimics the text-classification pipeline with a cost
+  model of per-call overhead + per-text time, so batching still pays off.
+- FakeWhisperModel sleeps proportionally to the audio length.
+"""
+import hashlib
+import random
+import re
+import sys
+import threading
+import time
+import types
+
+GO_EMOTIONS_LABELS = [
+    "admiration", "amusement", "anger", "annoyance", "approval", "caring", "confusion",
+    "curiosity", "desire", "disappointment", "disapproval", "disgust", "embarrassment",
+    "excitement", "fear", "gratitude", "grief", "joy", "love", "nervousness", "optimism",
+    "pride", "realization", "relief", "remorse", "sadness", "surprise", "neutral",
+]
+
+# Median latency per prompt kind, before --gemini-latency-scale
+GEMINI_LATENCY_MS = {
+    "judge": 900,
+    "judge_batch": 1400,
+    "reflect": 700,
+    "reflect_batch": 1000,
+    "captions": 800,
+    "recommendations": 1200,
+    "entertainment": 1000,
+    "other": 400,
+}
+
+def _stable_fraction(text):
+    """Deterministic value in [0, 1) for a piece of text"""
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16) / 0x100000000
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeGeminiModel:
+    """Drop-in for genai.GenerativeModel with canned, parseable answers"""
+
+    def __init__(self, name="fake-gemini", latency_scale=0.1, jitter=0.3, judge_score=8,
+                 low_score_rate=0.25, error_rate=0.0, seed=0):
+        self.name = name
+        self.latency_scale = latency_scale
+        self.jitter = jitter
+        self.judge_score = judge_score
+        self.low_score_rate = low_score_rate
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def _sleep(self, kind):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            factor = self._random.lognormvariate(0, self.jitter) if self.jitter else 1.0
+            fail = self._random.random() < self.error_rate
+        time.sleep(GEMINI_LATENCY_MS[kind] * self.latency_scale * factor / 1000)
+        if fail:
+            raise RuntimeError(f"Injected Gemini failure ({kind})")
+
+    def _score(self, candidate):
+        if _stable_fraction(candidate) < self.low_score_rate:
+            return 5
+        return self.judge_score
+
+    def _judge_block(self, candidate):
+        score = self._score(candidate)
+        part = score / 4
+        critique = "Good caption" if score >= 7 else "Too generic, make it wittier"
+        # Real judges often compare candidates in their reasons; the parser must
+        # not mistake such a line for the next CANDIDATE header
+        return (
+            f"TONE_SCORE: {part:.1f}\nTONE_REASON: Matches the mood\n"
+            f"Candidate 4 is funnier because it uses wordplay\n"
+            f"RELEVANCE_SCORE: {part:.1f}\nRELEVANCE_REASON: Fits the context\n"
+            f"APPROPRIATENESS_SCORE: {part:.1f}\nAPPROPRIATENESS_REASON: Family friendly\n"
+            f"SAFETY_SCORE: {part:.1f}\nSAFETY_REASON: Emotionally safe\n"
+            f"TOTAL_SCORE: {score}\nOVERALL_CRITIQUE: {critique}"
+        )
+
+    def generate_content(self, prompt, **kwargs):
+        if "Candidate Captions:" in prompt:
+            self._sleep("judge_batch")
+            candidates = re.findall(r'CANDIDATE (\d+): """(.*?)"""', prompt)
+            return FakeResponse("\n\n".join(
+                f"CANDIDATE {number}\n{self._judge_block(caption)}" for number, caption in candidates
+            ))
+        if "Candidate Caption:" in prompt:
+            self._sleep("judge")
+            caption = prompt.split('"""')[1] if '"""' in prompt else prompt
+            return FakeResponse(self._judge_block(caption))
+        if "The captions below scored low" in prompt:
+            self._sleep("reflect_batch")
+            numbers = sorted(set(re.findall(r'CANDIDATE (\d+)\b', prompt.split("Reflection instructions:")[0])))
+            return FakeResponse("\n".join(f"CANDIDATE {n}: Behtar caption number {n} yaar" for n in numbers))
+        if "Original caption:" in prompt or "Original text:" in prompt:
+            self._sleep("reflect")
+            return FakeResponse("Zindagi mein thora sa mazaa bhi zaroori hai")
+        if "Roman Urdu captions" in prompt:
+            self._sleep("captions")
+            return FakeResponse(
+                "Exam ki tension, chai ki attention\n"
+                "Neend puri, kaam adhoora\n"
+                "Boss ka message, weekend ka funeral\n"
+                "Dil se smile, wallet se cry"
+            )
+        if "entertainment recommendation expert" in prompt:
+            self._sleep("entertainment")
+            return FakeResponse(
+                "Movies/Series:\nZindagi Na Milegi Dobara\nThe Secret Life of Walter Mitty\n\n"
+                "Music:\nIlahi - Arijit Singh\nHere Comes the Sun - The Beatles\n\n"
+                "Books:\nThe Alchemist - Paulo Coelho\nMan's Search for Meaning - Viktor Frankl"
+            )
+        if "psychiatrist" in prompt or "support message" in prompt:
+            self._sleep("recommendations")
+            return FakeResponse(
+                "❤️ It's okay to feel this way, you're not alone.\n"
+                "🌿 Take slow deep breaths\n🌞 Step outside for sunlight\n"
+                "📓 Write down your thoughts\n💧 Drink some water now\n\n"
+                "If it keeps weighing on you, a counselor can help."
+            )
+        self._sleep("other")
+        return FakeResponse("Hello!")
+
+class FakeTranslator:
+    """googletrans.Translator stand-in with a fixed per-call latency"""
+
+    def __init__(self, latency_ms=150):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def translate(self, text, src=None, dest=None):
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        if isinstance(text, str):
+            return FakeResponse(f"[en] {text}")
+        return [FakeResponse(f"[en] {item}") for item in text]
+
+class FakeEmotionPipeline:
+    """
+    Text-classification pipeline stand-in. Each call costs call_ms plus
+    text_ms per text, roughly how a CPU forward pass scales with batching.
+    """
+
+    tokenizer = None
+
+    def __init__(self, call_ms=15, text_ms=4):
+        self.call_ms = call_ms
+        self.text_ms = text_ms
+
+    def _scores(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [{"label": label, "score": digest[i] / 255.0} for i, label in enumerate(GO_EMOTIONS_LABELS)]
+
+    def __call__(self, inputs, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        time.sleep((self.call_ms + self.text_ms * len(texts)) / 1000)
+        return [self._scores(text) for text in texts]
+
+class FakeWhisperModel:
+    """whisper model stand-in; realtime_factor=0.1 means 10 s of audio takes 1 s"""
+
+    def __init__(self, realtime_factor=0.1, sample_rate=16000):
+        self.realtime_factor = realtime_factor
+        self.sample_rate = sample_rate
+
+    def transcribe(self, audio, **options):
+        time.sleep(len(audio) / self.sample_rate * self.realtime_factor)
+        return {"text": "aaj ka din bohat thaka dene wala tha", "language": "ur"}
+
+def install_sdk_stubs():
+    """
+    Register an import stub for google.generativeai when the SDK is not
+    installed, so app.py can be imported on a machine without it. The
+    harness replaces app.gemini_model with a FakeGeminiModel either way.
+    """
+    try:
+        import google.generativeai  # noqa: F401
+        return False
+    except ImportError:
+        pass
+    google = sys.modules.get("google") or types.ModuleType("google")
+    if not hasattr(google, "__path__"):
+        google.__path__ = []
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = lambda name: FakeGeminiModel(name)
+    google.generativeai = genai
+    sys.modules["google"] = google
+    sys.modules["google.generativeai"] = genai
+    return True
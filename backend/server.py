@@ -0,0 +1,12 @@
+"""
+Entry point for the API server: python server.py
+
+Whisper workers are spawned processes, and spawn re-imports the __main__
+module in each of them. Keeping that module this small means a worker
+imports only whisper_worker and its model, not app.py and its
+module-level setup.
+"""
+
+if __name__ == '__main__':
+    import app
+    app.run_server()
@@ -0,0 +1,34 @@
+"""
+Whisper transcription that runs inside worker processes.
+
+Kept separate from app.py so worker tasks do not need the Flask app. Each
+process loads its model once in init_worker(); Whisper itself is imported
+there too, so importing this module from the API process stays cheap.
+
+Spawned workers also re-import the __main__ module. Start the server with
+`python server.py` so that is a near-empty module. Under `python app.py`,
+every one of the WHISPER_WORKERS processes imports all of app.py as
+well, running its module-level setup (executors, caches, the Gemini client)
+and adding roughly 40 MB per worker on top of its own Whisper model.
+"""
+_model = None
+
+def load_model(model_size):
+    import whisper
+    return whisper.load_model(model_size)
+
+def init_worker(model_size):
+    global _model
+    _model = load_model(model_size)
+
+def transcribe_chunk(audio, options):
+    """Transcribe one float32 16 kHz chunk. Returns {'text', 'language'}."""
+    result = _model.transcribe(audio, **options)
+    return {
+        "text": result.get("text", "").strip(),
+        "language": result.get("language", "")
+    }
+
+def ping():
+    """Lets the API process wait until a worker has finished loading"""
+    return _model is not None